@@ -58,3 +58,23 @@ EXPAND_PATH_WILDCARDS = True
 # structures
 # This  is used in nilearn._utils.cache_mixin
 CHECK_CACHE_VERSION = True
+
+# Maximum size, in bytes, of the temporary arrays used when signals are
+# processed by blocks of columns (detrending, standardization, confounds
+# removal, filtering). Blocks of a few megabytes stay in the processor
+# caches and are usually the fastest; smaller blocks lower the peak memory
+# usage.
+# This is used in nilearn.signal
+MAX_TEMPORARY_BYTES = 4 * 1024 * 1024  # 4Mb
+
+# Boolean controlling whether confounds read from CSV files are saved in a
+# .npy file next to them ("confounds.csv.npy"), which is loaded instead of
+# parsing the CSV file when it is more recent.
+# This is used in nilearn.signal
+CONFOUNDS_NPY_SIDECAR = False
+
+# Maximum size, in bytes, of the arrays kept by the cache of resampling
+# plans: the interpolation indices and weights of the geometries most
+# recently resampled. Set it to 0 to keep none.
+# This is used in nilearn.image.resampling
+RESAMPLING_CACHE_BYTES = 64 * 1024 * 1024  # 64Mb
@@ -4,6 +4,9 @@ N-dimensional image manipulation
 # Author: Gael Varoquaux, Alexandre Abraham, Philippe Gervais
 # License: simplified BSD
 
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
 from scipy import ndimage
 
@@ -47,3 +50,44 @@ def get_border_data(data, border_size):
         data[:, :, :border_size].ravel(),
         data[:, :, -border_size:].ravel(),
     ])
+
+
+###############################################################################
+# Operating on volumes in parallel
+###############################################################################
+
+def _thread_map(function, iterable, n_jobs=1):
+    """Return [function(item) for item in iterable], using n_jobs threads.
+
+    Threads only run in parallel if function releases the GIL, as most of
+    scipy.ndimage and numpy do. As threads share memory, function can write
+    its results into a common output array.
+
+    Parameters
+    -----------
+    function: callable
+        Function of one argument.
+
+    iterable: iterable
+        Arguments of the calls to function.
+
+    n_jobs: int, optional
+        The number of threads to use. -1 means 'all CPUs'.
+
+    Returns
+    --------
+    results: list
+        Return values of function, in the order of iterable.
+    """
+    if n_jobs < 0:
+        n_jobs = max(multiprocessing.cpu_count() + 1 + n_jobs, 1)
+    elif n_jobs == 0:
+        raise ValueError('n_jobs == 0 has no meaning')
+    if n_jobs == 1:
+        return [function(item) for item in iterable]
+    pool = ThreadPool(n_jobs)
+    try:
+        return pool.map(function, iterable)
+    finally:
+        pool.close()
+        pool.join()
@@ -7,6 +7,7 @@ Neuroimaging file input and output.
 import copy
 import gc
 import collections
+import numbers
 
 import numpy as np
 import nibabel
@@ -28,6 +29,57 @@ def _safe_get_data(img):
     return img.get_data()
 
 
+def _is_compressed_file(img):
+    """ Whether the data of img is in a compressed file.
+
+        Each read through the array proxy of a compressed file decompresses
+        it from the start: it is cheaper to load the data once.
+    """
+    image_map = getattr(img, 'file_map', {}).get('image')
+    filename = getattr(image_map, 'filename', None)
+    return (isinstance(filename, _basestring) and
+            filename.endswith(('.gz', '.bz2')))
+
+
+def _get_data_slice(img, index, copy=False):
+    """ Get img.get_data()[index] without loading the whole image.
+
+        If the data of a file-backed image is not already in memory, only
+        the requested part is read from disk, through the array proxy.
+        If copy is True, the returned array does not share memory with the
+        image.
+    """
+    dataobj = getattr(img, 'dataobj', None)
+    if (getattr(img, '_data_cache', None) is None and dataobj is not None
+            and not isinstance(dataobj, np.ndarray)):
+        return np.asarray(dataobj[index])
+    data = img.get_data()[index]
+    if copy:
+        data = data.copy()
+    return data
+
+
+def _get_volumes(img, index):
+    """ Get img.get_data()[..., index] without loading the whole image.
+
+        index can be anything that indexes the fourth dimension of a numpy
+        array. Array proxies only support basic indexing: lists or arrays
+        of indices are read volume by volume.
+    """
+    if isinstance(index, (slice, numbers.Integral)):
+        return _get_data_slice(img, (Ellipsis, index))
+    dataobj = getattr(img, 'dataobj', None)
+    if (getattr(img, '_data_cache', None) is not None or dataobj is None
+            or isinstance(dataobj, np.ndarray)):
+        return img.get_data()[..., index]
+    # Indices of the volumes, with the checks and errors of numpy
+    volumes = np.arange(img.shape[3])[index]
+    if volumes.size == 0:
+        return _get_data_slice(img, (Ellipsis, slice(0, 0)))
+    return np.concatenate([_get_data_slice(img, (Ellipsis, slice(n, n + 1)))
+                           for n in volumes], axis=3)
+
+
 def _get_data_dtype(img):
     """Returns the dtype of an image.
     If the image is non standard (no get_data_dtype member), this function
@@ -15,17 +15,22 @@ from scipy import ndimage
 import copy
 import nibabel
 from sklearn.externals.joblib import Parallel, delayed
+from sklearn.utils import gen_even_slices
 
+import nilearn
 from .. import signal
 from .._utils import (check_niimg_4d, check_niimg_3d, check_niimg, as_ndarray,
                       _repr_niimgs)
 from .._utils.niimg_conversions import _index_img
-from .._utils.niimg import _safe_get_data
+from .._utils.niimg import (_safe_get_data, _get_data_slice, _get_volumes,
+                            _is_compressed_file)
 from .._utils.compat import _basestring
+from .._utils.ndimage import _thread_map
 
 
 def high_variance_confounds(imgs, n_confounds=5, percentile=2.,
-                            detrend=True, mask_img=None):
+                            detrend=True, mask_img=None, svd_solver='full',
+                            random_state=None):
     """ Return confounds signals extracted from input signals with highest
         variance.
 
@@ -51,6 +56,14 @@ def high_variance_confounds(imgs, n_confounds=5, percentile=2.,
         detrend: bool
             If True, detrend signals before processing.
 
+        svd_solver: {'full', 'randomized'}
+            Method used for the singular value decomposition. See
+            nilearn.signal.high_variance_confounds.
+
+        random_state: int or RandomState, optional
+            Pseudo-random number generator state used for the randomized
+            decomposition.
+
         Returns
         =======
         v: numpy.ndarray
@@ -69,25 +82,44 @@ def high_variance_confounds(imgs, n_confounds=5, percentile=2.,
         - return a given number (n_confounds) of signals from the svd with
           highest singular values.
 
+        The image is read by slabs, twice: with a file-backed image, the
+        whole 4D data is never loaded in memory.
+
         See also
         ========
         nilearn.signal.high_variance_confounds
     """
     from .. import masking
 
+    imgs = check_niimg_4d(imgs)
+    mask = None
     if mask_img is not None:
-        sigs = masking.apply_mask(imgs, mask_img)
-    else:
-        # Load the data only if it doesn't need to be masked
-        imgs = check_niimg_4d(imgs)
-        sigs = as_ndarray(imgs.get_data())
-        # Not using apply_mask here saves memory in most cases.
-        del imgs  # help reduce memory consumption
-        sigs = np.reshape(sigs, (-1, sigs.shape[-1])).T
-
-    return signal.high_variance_confounds(sigs, n_confounds=n_confounds,
-                                           percentile=percentile,
-                                           detrend=detrend)
+        mask, mask_affine = masking._load_mask_img(mask_img)
+        if not np.allclose(mask_affine, imgs.get_affine()):
+            raise ValueError('Mask affine: \n%s\n is different from img '
+                             'affine:\n%s' % (str(mask_affine),
+                                               str(imgs.get_affine())))
+        if not mask.shape == imgs.shape[:3]:
+            raise ValueError('Mask shape: %s is different from img shape:%s'
+                             % (str(mask.shape), str(imgs.shape[:3])))
+
+    def blocks():
+        # Slabs of the image along the first axis are read one at a time,
+        # from the array proxy for file-backed images.
+        n_slabs = min(10, imgs.shape[0])
+        for slab in gen_even_slices(imgs.shape[0], n_slabs):
+            data = _get_data_slice(imgs, slab)
+            if mask is None:
+                yield np.reshape(data, (-1, data.shape[-1])).T
+            else:
+                data = data[mask[slab]].T
+                # Same as masking.apply_mask
+                data[np.logical_not(np.isfinite(data))] = 0
+                yield data
+
+    return signal._high_variance_confounds(
+        blocks, n_confounds=n_confounds, percentile=percentile,
+        detrend=detrend, svd_solver=svd_solver, random_state=random_state)
 
 
 def _fast_smooth_array(arr):
@@ -139,7 +171,8 @@ def _fast_smooth_array(arr):
     return smoothed_arr
 
 
-def _smooth_array(arr, affine, fwhm=None, ensure_finite=True, copy=True):
+def _smooth_array(arr, affine, fwhm=None, ensure_finite=True, copy=True,
+                  n_jobs=1):
     """Smooth images by applying a Gaussian filter.
 
     Apply a Gaussian filter along the three first dimensions of arr.
@@ -174,6 +207,10 @@ def _smooth_array(arr, affine, fwhm=None, ensure_finite=True, copy=True):
         if True, input array is not modified. False by default: the filtering
         is performed in-place.
 
+    n_jobs: int, optional
+        The number of threads filtering the volumes of a 4D array. -1 means
+        'all CPUs'.
+
     Returns
     =======
     filtered_arr: numpy.ndarray
@@ -197,23 +234,57 @@ def _smooth_array(arr, affine, fwhm=None, ensure_finite=True, copy=True):
         # SPM tends to put NaNs in the data outside the brain
         arr[np.logical_not(np.isfinite(arr))] = 0
 
-    if fwhm == 'fast':
-        arr = _fast_smooth_array(arr)
-    elif fwhm is not None:
-        # Keep only the scale part.
-        affine = affine[:3, :3]
-
-        # Convert from a FWHM to a sigma:
-        fwhm_over_sigma_ratio = np.sqrt(8 * np.log(2))
-        vox_size = np.sqrt(np.sum(affine ** 2, axis=0))
-        sigma = fwhm / (fwhm_over_sigma_ratio * vox_size)
-        for n, s in enumerate(sigma):
-            ndimage.gaussian_filter1d(arr, s, output=arr, axis=n)
+    if fwhm is None:
+        return arr
+    if fwhm != 'fast':
+        sigma = _fwhm2sigma(affine, fwhm)
+
+    def smooth(index):
+        if fwhm == 'fast':
+            arr[index] = _fast_smooth_array(arr[index])
+        else:
+            for n, s in enumerate(sigma):
+                ndimage.gaussian_filter1d(arr[index], s, output=arr[index],
+                                          axis=n)
 
+    if n_jobs == 1 or arr.ndim == 3:
+        smooth(Ellipsis)
+    else:
+        # The filters release the GIL: volumes are filtered in place by
+        # parallel threads
+        _thread_map(smooth, [(Ellipsis, ) + index
+                             for index in np.ndindex(*arr.shape[3:])],
+                    n_jobs=n_jobs)
     return arr
 
 
-def smooth_img(imgs, fwhm):
+def _fwhm2sigma(affine, fwhm):
+    """Convert a FWHM in millimeters to a standard deviation in voxels."""
+    # Keep only the scale part.
+    affine = affine[:3, :3]
+
+    # Convert from a FWHM to a sigma:
+    fwhm_over_sigma_ratio = np.sqrt(8 * np.log(2))
+    vox_size = np.sqrt(np.sum(affine ** 2, axis=0))
+    return fwhm / (fwhm_over_sigma_ratio * vox_size)
+
+
+def _smoothing_margin(affine, fwhm):
+    """Extent of the filter applied by _smooth_array.
+
+    Returns, for each of the three axes, the number of voxels on each side
+    of a voxel that are used to compute its smoothed value.
+    """
+    if fwhm is None:
+        return np.zeros(3, dtype=np.int)
+    if fwhm == 'fast':
+        return np.ones(3, dtype=np.int)
+    # gaussian_filter1d truncates its kernel at 4 standard deviations
+    sigma = _fwhm2sigma(affine, fwhm) * np.ones(3)
+    return (4. * sigma + .5).astype(np.int)
+
+
+def smooth_img(imgs, fwhm, n_jobs=1):
     """Smooth images by applying a Gaussian filter.
 
     Apply a Gaussian filter along the three first dimensions of arr.
@@ -235,6 +306,10 @@ def smooth_img(imgs, fwhm):
         If fwhm is None, no filtering is performed (useful when just removal
         of non-finite values is needed)
 
+    n_jobs: int, optional
+        The number of threads filtering the volumes of 4D images. -1 means
+        'all CPUs'.
+
     Returns
     =======
     filtered_img: nibabel.Nifti1Image or list of.
@@ -256,7 +331,8 @@ def smooth_img(imgs, fwhm):
         img = check_niimg(img)
         affine = img.get_affine()
         filtered = _smooth_array(img.get_data(), affine, fwhm=fwhm,
-                                 ensure_finite=True, copy=True)
+                                 ensure_finite=True, copy=True,
+                                 n_jobs=n_jobs)
         ret.append(new_img_like(img, filtered, affine, copy_header=True))
 
     if single_img:
@@ -296,13 +372,10 @@ def _crop_img_to(img, slices, copy=True):
     """
 
     img = check_niimg(img)
-
-    data = img.get_data()
     affine = img.get_affine()
 
-    cropped_data = data[slices]
-    if copy:
-        cropped_data = cropped_data.copy()
+    # Only the cropped data is read from file-backed images
+    cropped_data = _get_data_slice(img, tuple(slices), copy=copy)
 
     linear_part = affine[:3, :3]
     old_origin = affine[:3, 3]
@@ -345,20 +418,31 @@ def crop_img(img, rtol=1e-8, copy=True):
     """
 
     img = check_niimg(img)
-    data = img.get_data()
-    infinity_norm = max(-data.min(), data.max())
-    passes_threshold = np.logical_or(data < -rtol * infinity_norm,
-                                     data > rtol * infinity_norm)
+    if _is_compressed_file(img):
+        # Load the data once: it is then cropped in memory
+        img.get_data()
+    shape = img.shape
+    # Maximum absolute value of each voxel. The volumes of file-backed
+    # images are read by blocks, without loading the whole image.
+    if len(shape) == 4:
+        n_volumes = max(1, int(nilearn.MAX_TEMPORARY_BYTES //
+                               (8 * np.prod(shape[:3]))))
+        voxel_max = np.zeros(shape[:3])
+        for start in range(0, shape[3], n_volumes):
+            block = _get_volumes(img, slice(start, start + n_volumes))
+            voxel_max = np.maximum(voxel_max, np.abs(block).max(axis=-1))
+    else:
+        voxel_max = np.abs(_get_data_slice(img, Ellipsis))
+    infinity_norm = voxel_max.max()
+    passes_threshold = voxel_max > rtol * infinity_norm
 
-    if data.ndim == 4:
-        passes_threshold = np.any(passes_threshold, axis=-1)
     coords = np.array(np.where(passes_threshold))
     start = coords.min(axis=1)
     end = coords.max(axis=1) + 1
 
     # pad with one voxel to avoid resampling problems
     start = np.maximum(start - 1, 0)
-    end = np.minimum(end + 1, data.shape[:3])
+    end = np.minimum(end + 1, shape[:3])
 
     slices = [slice(s, e) for s, e in zip(start, end)]
 
@@ -527,7 +611,11 @@ def index_img(imgs, index):
 
     """
     imgs = check_niimg_4d(imgs)
-    return _index_img(imgs, index)
+    if _is_compressed_file(imgs):
+        return _index_img(imgs, index)
+    # Only the requested volumes are read from uncompressed files
+    return new_img_like(imgs, _get_volumes(imgs, index), imgs.get_affine(),
+                        copy_header=True)
 
 
 def iter_img(imgs):
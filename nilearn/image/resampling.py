@@ -5,6 +5,7 @@ See http://nilearn.github.io/building_blocks/manipulating_mr_images.html#niimg.
 # Author: Gael Varoquaux, Alexandre Abraham, Michael Eickenberg
 # License: simplified BSD
 
+import collections
 import warnings
 from distutils.version import LooseVersion
 
@@ -12,8 +13,10 @@ import numpy as np
 import scipy
 from scipy import ndimage, linalg
 
+import nilearn
 from .. import _utils
 from .._utils.compat import _basestring
+from .._utils.ndimage import _thread_map
 
 ###############################################################################
 # Affine utils
@@ -215,29 +218,9 @@ class BoundingBoxError(ValueError):
 ###############################################################################
 # Resampling
 
-def _resample_one_img(data, A, A_inv, b, target_shape,
-                      interpolation_order, out, copy=True):
+def _resample_one_img(data, A, offset, target_shape,
+                      interpolation_order, out):
     "Internal function for resample_img, do not use"
-    if data.dtype.kind in ('i', 'u'):
-        # Integers are always finite
-        has_not_finite = False
-    else:
-        not_finite = np.logical_not(np.isfinite(data))
-        has_not_finite = np.any(not_finite)
-    if has_not_finite:
-        warnings.warn("NaNs or infinite values are present in the data "
-                        "passed to resample. This is a bad thing as they "
-                        "make resampling ill-defined and much slower.",
-                        RuntimeWarning, stacklevel=2)
-        if copy:
-            # We need to do a copy to avoid modifying the input
-            # array
-            data = data.copy()
-        #data[not_finite] = 0
-        from ..masking import _extrapolate_out_mask
-        data = _extrapolate_out_mask(data, np.logical_not(not_finite),
-                                     iterations=2)[0]
-
     # See https://github.com/nilearn/nilearn/issues/346 Copying the
     # array makes it C continuous and as such the int32 index in the C
     # code is a lot less likely to overflow
@@ -246,7 +229,7 @@ def _resample_one_img(data, A, A_inv, b, target_shape,
 
     # The resampling itself
     ndimage.affine_transform(data, A,
-                             offset=np.dot(A_inv, b),
+                             offset=offset,
                              output_shape=target_shape,
                              output=out,
                              order=interpolation_order)
@@ -257,19 +240,384 @@ def _resample_one_img(data, A, A_inv, b, target_shape,
     if (LooseVersion(scipy.__version__) < LooseVersion('0.15') and
         not out.dtype.isnative):
         out.byteswap(True)
-
-    if has_not_finite:
-        # We need to resample the mask of not_finite values
-        not_finite = ndimage.affine_transform(not_finite, A,
-                                            offset=np.dot(A_inv, b),
-                                            output_shape=target_shape,
-                                            order=0)
-        out[not_finite] = np.nan
     return out
 
 
+def _interpolation_weights(coords, size, interpolation_order):
+    """Weights of the interpolation of a 1D signal at coords.
+
+    Returns a (len(coords), size) array W such that W.dot(signal) is the
+    nearest neighbor interpolation of signal (interpolation_order=0), or
+    W.dot(coefficients) the cubic spline interpolation of the signal with
+    spline coefficients coefficients (interpolation_order=3). As in
+    ndimage.affine_transform, coordinates outside [0, size - 1] give 0, and
+    the signal is mirrored at its edges.
+    """
+    weights = np.zeros((len(coords), size))
+    inside = np.where(np.logical_and(coords >= 0, coords <= size - 1))[0]
+    coords = coords[inside]
+    if interpolation_order == 0:
+        weights[inside, np.floor(coords + .5).astype(np.int)] = 1.
+        return weights
+
+    first = np.floor(coords).astype(np.int) - 1
+    for shift in range(4):
+        index = first + shift
+        # Cubic B-spline
+        distance = np.abs(coords - index)
+        weight = np.where(distance < 1.,
+                          (4. - 6. * distance ** 2 + 3. * distance ** 3) / 6.,
+                          np.where(distance < 2., (2. - distance) ** 3 / 6.,
+                                   0.))
+        # Mirror at the edges
+        if size > 1:
+            index = np.abs(index)
+            index = np.where(index > size - 1, 2 * (size - 1) - index, index)
+        else:
+            index = np.zeros_like(index)
+        weights[inside, index] += weight
+    return weights
+
+
+def _dot_axis(weights, data, axis):
+    """Product of weights with data along axis of data."""
+    return np.rollaxis(np.tensordot(weights, data, axes=(1, axis)), 0,
+                       axis + 1)
+
+
+class _ResamplingPlan(object):
+    """Geometry of the resampling of images to a target grid.
+
+    Computed from the shape and affine of the images, and from the target
+    affine and shape given to resample_img. The arrays used to resample
+    several volumes at once are computed when first needed, and kept.
+
+    Attributes
+    ----------
+    target_affine: numpy.ndarray
+        (4, 4) affine of the resampled images.
+
+    target_shape: tuple
+        Shape of the resampled volumes.
+
+    A, b: numpy.ndarray
+        Voxel (i, j, k) of the resampled volumes is at coordinates
+        A.dot((i, j, k)) + b in the input volumes.
+
+    diagonal: bool
+        Whether A is diagonal.
+    """
+
+    def __init__(self, shape, affine, target_affine, target_shape=None):
+        self.shape = tuple(shape[:3])
+        # Embed target_affine in 4x4 shape if necessary
+        if target_affine.shape == (3, 3):
+            missing_offset = True
+            target_affine_tmp = np.eye(4)
+            target_affine_tmp[:3, :3] = target_affine
+            target_affine = target_affine_tmp
+        else:
+            missing_offset = False
+            target_affine = target_affine.copy()
+        # Get a bounding box for the transformed data
+        transform_affine = np.linalg.inv(target_affine).dot(affine)
+        (xmin, xmax), (ymin, ymax), (zmin, zmax) = get_bounds(
+            self.shape, transform_affine)
+
+        # if target_affine is (3, 3), then calculate
+        # offset from bounding box and update bounding box
+        # to be in the voxel coordinates of the calculated 4x4 affine
+        if missing_offset:
+            offset = target_affine[:3, :3].dot([xmin, ymin, zmin])
+            target_affine[:3, 3] = offset
+            (xmin, xmax), (ymin, ymax), (zmin, zmax) = (
+                (0, xmax - xmin), (0, ymax - ymin), (0, zmax - zmin))
+
+        # if target_shape is not given (always the case with 3x3
+        # transformation matrix and sometimes the case with 4x4
+        # transformation matrix), then set it to contain the bounding
+        # box by a margin of 1 voxel
+        if target_shape is None:
+            target_shape = (int(np.ceil(xmax)) + 1,
+                            int(np.ceil(ymax)) + 1,
+                            int(np.ceil(zmax)) + 1)
+
+        # Check whether transformed data is actually within the FOV
+        # of the target affine
+        if xmax < 0 or ymax < 0 or zmax < 0:
+            raise BoundingBoxError("The field of view given "
+                                   "by the target affine does "
+                                   "not contain any of the data")
+
+        if np.all(target_affine == affine):
+            # Small trick to be more numerically stable
+            transform_affine = np.eye(4)
+        else:
+            transform_affine = np.dot(linalg.inv(affine), target_affine)
+        self.A, self.b = to_matrix_vector(transform_affine)
+        self.diagonal = np.all(np.diag(np.diag(self.A)) == self.A)
+
+        # Make sure that we have a tuple here
+        if isinstance(target_shape, np.ndarray):
+            target_shape = target_shape.tolist()
+        self.target_shape = tuple(target_shape)
+        self.target_affine = target_affine
+        self._nearest_indices = {}
+        self._weights = {}
+
+    def nearest_indices(self, source_layout, target_layout):
+        """Indices for nearest neighbor interpolation.
+
+        Returns flat indices, in target_layout ('F' or 'C') order, of the
+        target voxels inside the input volumes, and flat indices, in
+        source_layout order, of the nearest input voxels. The first ones
+        are None if all target voxels are inside.
+        """
+        layout = (source_layout, target_layout)
+        if layout not in self._nearest_indices:
+            # Strides of the input voxels in flat indices
+            strides = np.cumprod((1, ) + self.shape[:-1])
+            if source_layout == 'C':
+                strides = np.cumprod((1, ) + self.shape[:0:-1])[::-1]
+            # Computed with broadcasting on the target grid: with diagonal
+            # A, the coordinates along each axis are 1D arrays.
+            grid = np.ogrid[tuple(slice(0, n) for n in self.target_shape)]
+            inside = np.ones(self.target_shape, dtype=np.bool)
+            source = 0
+            for axis, size in enumerate(self.shape):
+                coords = self.b[axis]
+                for k in range(3):
+                    if self.A[axis, k] != 0:
+                        coords = coords + self.A[axis, k] * grid[k]
+                coords = np.asarray(coords)
+                inside &= coords >= 0
+                inside &= coords <= size - 1
+                source = source + strides[axis] * np.floor(
+                    coords + .5).astype(np.intp)
+            source = np.broadcast_arrays(source, inside)[0]
+            inside = inside.ravel(order=target_layout)
+            source = source.ravel(order=target_layout)[inside]
+            if np.all(inside):
+                target = None
+            else:
+                target = np.where(inside)[0]
+            self._nearest_indices[layout] = (target, source)
+        return self._nearest_indices[layout]
+
+    @property
+    def nbytes(self):
+        """Size, in bytes, of the indices and weights kept."""
+        arrays = [array for indices in self._nearest_indices.values()
+                  for array in indices if array is not None]
+        arrays.extend(array for weights in self._weights.values()
+                      for array in weights)
+        return sum(array.nbytes for array in arrays)
+
+    def weights(self, interpolation_order):
+        """Weights of the separable interpolation along each axis.
+
+        Only valid if A is diagonal.
+        """
+        if interpolation_order not in self._weights:
+            self._weights[interpolation_order] = [_interpolation_weights(
+                self.A[axis, axis] * np.arange(self.target_shape[axis]) +
+                self.b[axis], self.shape[axis], interpolation_order)
+                for axis in range(3)]
+        return self._weights[interpolation_order]
+
+
+# Resampling plans, least recently used first
+_resampling_plans = collections.OrderedDict()
+_RESAMPLING_PLANS_CACHE_SIZE = 8
+
+
+def _trim_resampling_plans():
+    """Discard the least recently used resampling plans, until the cache
+    holds at most _RESAMPLING_PLANS_CACHE_SIZE plans, and their arrays at
+    most nilearn.RESAMPLING_CACHE_BYTES.
+    """
+    nbytes = sum(plan.nbytes for plan in _resampling_plans.values())
+    while _resampling_plans and (
+            len(_resampling_plans) > _RESAMPLING_PLANS_CACHE_SIZE or
+            nbytes > nilearn.RESAMPLING_CACHE_BYTES):
+        nbytes -= _resampling_plans.popitem(last=False)[1].nbytes
+
+
+def clear_resampling_cache():
+    """Discard the resampling plans kept by resample_img.
+
+    resample_img keeps the geometry, and the interpolation indices and
+    weights, of the images it resampled most recently, to resample faster
+    other images with the same geometry. Their size is bounded by
+    nilearn.RESAMPLING_CACHE_BYTES.
+    """
+    _resampling_plans.clear()
+
+
+def _get_resampling_plan(shape, affine, target_affine, target_shape=None):
+    """Get the _ResamplingPlan of images with the given shape and affine, or
+    get it from the cache of plans already computed.
+
+    Geometries are identified by the affines rounded to 1e-6, and the shapes.
+    """
+    key = (tuple(shape[:3]), tuple(np.round(affine, 6).ravel()),
+           tuple(np.round(target_affine, 6).ravel()), target_affine.shape,
+           None if target_shape is None else tuple(target_shape))
+    if key in _resampling_plans:
+        # Most recently used
+        plan = _resampling_plans.pop(key)
+        _resampling_plans[key] = plan
+        return plan
+
+    plan = _ResamplingPlan(shape, affine, target_affine, target_shape)
+    _resampling_plans[key] = plan
+    _trim_resampling_plans()
+    return plan
+
+
+def _resample_volumes(data, plan, interpolation_order, out, n_jobs=1):
+    """Resample all the volumes of data at once, following plan.
+
+    With nearest neighbor interpolation, the nearest input voxels are
+    gathered for all volumes. Otherwise plan.A must be diagonal, and data
+    finite: the interpolation is separable, and the weights along each
+    axis are applied to the spline coefficients of blocks of volumes, in
+    n_jobs threads.
+    """
+    n_volumes = int(np.prod(data.shape[3:]))
+    # data and out as (x, y, z, volumes) arrays, with the volumes in the
+    # same order. As out is contiguous, it is reshaped to a view.
+    layout = 'F' if out.flags.f_contiguous else 'C'
+    data = data.reshape(data.shape[:3] + (n_volumes, ), order=layout)
+    out = out.reshape(plan.target_shape + (n_volumes, ), order=layout)
+
+    if interpolation_order == 0:
+        # (voxels, volumes) arrays, without copying data
+        source_layout = 'F' if data.flags.f_contiguous else 'C'
+        data = data.reshape((-1, n_volumes), order=source_layout)
+        out = out.reshape((-1, n_volumes), order=layout)
+        target, source = plan.nearest_indices(source_layout, layout)
+        # The indices are kept only if they fit in the cache
+        _trim_resampling_plans()
+        if target is None:
+            target = Ellipsis
+        else:
+            out.fill(0)
+        # Blocks of gathered volumes take about nilearn.MAX_TEMPORARY_BYTES
+        block_size = max(1, int(nilearn.MAX_TEMPORARY_BYTES //
+                                (data.itemsize * max(len(source), 1))))
+        for start in range(0, n_volumes, block_size):
+            block = slice(start, start + block_size)
+            out[target, block] = data[source, block]
+        return
+
+    weights = plan.weights(interpolation_order)
+    _trim_resampling_plans()
+    # Blocks of volumes, in double precision, take about
+    # nilearn.MAX_TEMPORARY_BYTES
+    block_size = max(1, int(nilearn.MAX_TEMPORARY_BYTES //
+                            (8 * np.prod(data.shape[:3]))))
+
+    def resample_block(start):
+        block = slice(start, start + block_size)
+        coefficients = np.asarray(data[..., block], dtype=np.float)
+        for axis in range(3):
+            coefficients = ndimage.spline_filter1d(
+                coefficients, order=interpolation_order, axis=axis)
+        for axis in range(3):
+            coefficients = _dot_axis(weights[axis], coefficients, axis)
+        out[..., block] = coefficients
+
+    _thread_map(resample_block, range(0, n_volumes, block_size),
+                n_jobs=n_jobs)
+
+
+def _get_resampled_dtype(dtype, interpolation):
+    "Internal function for resample_img, do not use"
+    if interpolation == 'continuous' and dtype.kind == 'i':
+        # cast unsupported data types to closest support dtype
+        aux = dtype.name.replace('int', 'float')
+        aux = aux.replace("ufloat", "float").replace("floatc", "float")
+        if aux in ["float8", "float16"]:
+            aux = "float32"
+        warnings.warn("Casting data from %s to %s" % (dtype.name, aux))
+        return np.dtype(aux)
+    return dtype
+
+
+def _resample_masked(img, mask_img, interpolation='continuous'):
+    """Resample an image on the voxels of a mask only.
+
+    Equivalent to resampling img to the shape and affine of mask_img and
+    masking the result, without computing the resampled image outside of
+    the mask.
+
+    Parameters
+    ----------
+    img: Niimg-like object
+        See http://nilearn.github.io/building_blocks/manipulating_mr_images.html#niimg.
+        3D or 4D image to resample.
+
+    mask_img: Niimg-like object
+        See http://nilearn.github.io/building_blocks/manipulating_mr_images.html#niimg.
+        3D mask, defining the target grid and the voxels to compute.
+
+    interpolation: str, optional
+        Can be 'continuous' (default) or 'nearest'. Indicate the resample
+        method.
+
+    Returns
+    -------
+    series: numpy.ndarray
+        Resampled values of the voxels in the mask.
+        shape: (number of scans, number of voxels in the mask)
+    """
+    from .image import new_img_like  # avoid circular imports
+
+    if interpolation == 'continuous':
+        interpolation_order = 3
+    elif interpolation == 'nearest':
+        interpolation_order = 0
+    else:
+        message = ("interpolation must be either 'continuous' "
+                   "or 'nearest' but it was set to '{0}'").format(interpolation)
+        raise ValueError(message)
+
+    img = _utils.check_niimg(img, atleast_4d=True)
+    mask_img = _utils.check_niimg_3d(mask_img)
+    mask = _utils.as_ndarray(mask_img.get_data(), dtype=np.bool)
+    target_shape = mask.shape
+
+    A, b = to_matrix_vector(np.dot(linalg.inv(img.get_affine()),
+                                   mask_img.get_affine()))
+    # Coordinates in img of the voxels of the mask
+    coords = np.dot(A, np.asarray(np.where(mask))) + b[:, np.newaxis]
+
+    data = img.get_data()
+    n_scans = data.shape[3]
+    dtype = _get_resampled_dtype(data.dtype, interpolation)
+    series = np.empty((n_scans, coords.shape[1]), dtype=dtype)
+    for n in range(n_scans):
+        volume = data[..., n]
+        if (volume.dtype.kind not in ('i', 'u')
+                and not np.all(np.isfinite(volume))):
+            # Rare case: resample the whole volume, to get the same handling
+            # of non-finite values as resample_img.
+            out = resample_img(new_img_like(img, volume, img.get_affine()),
+                               target_affine=mask_img.get_affine(),
+                               target_shape=target_shape,
+                               interpolation=interpolation)
+            series[n] = out.get_data()[mask]
+        else:
+            ndimage.map_coordinates(volume, coords,
+                                    order=interpolation_order,
+                                    output=series[n])
+    return series
+
+
 def resample_img(img, target_affine=None, target_shape=None,
-                 interpolation='continuous', copy=True, order="F"):
+                 interpolation='continuous', copy=True, order="F",
+                 n_jobs=1):
     """Resample a Niimg-like object
 
     Parameters
@@ -300,6 +648,10 @@ def resample_img(img, target_affine=None, target_shape=None,
         Data ordering in output array. This function is slightly faster with
         Fortran ordering.
 
+    n_jobs: int, optional
+        The number of threads used to resample the volumes of a 4D image.
+        -1 means 'all CPUs'.
+
     Returns
     =======
     resampled: nibabel.Nifti1Image
@@ -337,7 +689,10 @@ def resample_img(img, target_affine=None, target_shape=None,
 
     **NaNs and infinite values**
     This function handles gracefully NaNs and infinite values in the input
-    data, however they make the execution of the function much slower.
+    data: with continuous interpolation, only the finite values are
+    interpolated, and the voxels whose nearest neighbor is not finite are
+    set to NaN. Where the finite values are too sparse to be interpolated,
+    the value of the nearest neighbor is used.
     """
     from .image import new_img_like  # avoid circular imports
 
@@ -393,77 +748,30 @@ def resample_img(img, target_affine=None, target_shape=None,
     # We now know that some resampling must be done.
     # The value of "copy" is of no importance: output is always a separate
     # array.
+    # The geometry is shared by many images (e.g. all the images of a
+    # study): it is computed once.
+    plan = _get_resampling_plan(shape, affine, target_affine, target_shape)
+    target_affine = plan.target_affine.copy()
+    target_shape = plan.target_shape
+    A, b = plan.A, plan.b
     data = img.get_data()
 
-    # Get a bounding box for the transformed data
-    # Embed target_affine in 4x4 shape if necessary
-    if target_affine.shape == (3, 3):
-        missing_offset = True
-        target_affine_tmp = np.eye(4)
-        target_affine_tmp[:3, :3] = target_affine
-        target_affine = target_affine_tmp
-    else:
-        missing_offset = False
-        target_affine = target_affine.copy()
-    transform_affine = np.linalg.inv(target_affine).dot(affine)
-    (xmin, xmax), (ymin, ymax), (zmin, zmax) = get_bounds(
-        data.shape[:3], transform_affine)
-
-    # if target_affine is (3, 3), then calculate
-    # offset from bounding box and update bounding box
-    # to be in the voxel coordinates of the calculated 4x4 affine
-    if missing_offset:
-        offset = target_affine[:3, :3].dot([xmin, ymin, zmin])
-        target_affine[:3, 3] = offset
-        (xmin, xmax), (ymin, ymax), (zmin, zmax) = (
-            (0, xmax - xmin), (0, ymax - ymin), (0, zmax - zmin))
-
-    # if target_shape is not given (always the case with 3x3
-    # transformation matrix and sometimes the case with 4x4
-    # transformation matrix), then set it to contain the bounding
-    # box by a margin of 1 voxel
-    if target_shape is None:
-        target_shape = (int(np.ceil(xmax)) + 1,
-                        int(np.ceil(ymax)) + 1,
-                        int(np.ceil(zmax)) + 1)
-
-    # Check whether transformed data is actually within the FOV
-    # of the target affine
-    if xmax < 0 or ymax < 0 or zmax < 0:
-        raise BoundingBoxError("The field of view given "
-                               "by the target affine does "
-                               "not contain any of the data")
-
-    if np.all(target_affine == affine):
-        # Small trick to be more numerically stable
-        transform_affine = np.eye(4)
-    else:
-        transform_affine = np.dot(linalg.inv(affine), target_affine)
-    A, b = to_matrix_vector(transform_affine)
-    A_inv = linalg.inv(A)
     # If A is diagonal, ndimage.affine_transform is clever enough to use a
     # better algorithm.
-    if np.all(np.diag(np.diag(A)) == A):
-        A = np.diag(A)
+    if plan.diagonal:
+        if LooseVersion(scipy.__version__) < LooseVersion('0.18'):
+            # The offset was applied before the zoom
+            offset = b / np.diag(A)
+        else:
+            offset = b
+        affine_matrix = np.diag(A)
     else:
-        b = np.dot(A, b)
+        offset = b
+        affine_matrix = A
 
     data_shape = list(data.shape)
-    # Make sure that we have a list here
-    if isinstance(target_shape, np.ndarray):
-        target_shape = target_shape.tolist()
-    target_shape = tuple(target_shape)
 
-    if interpolation == 'continuous' and data.dtype.kind == 'i':
-        # cast unsupported data types to closest support dtype
-        aux = data.dtype.name.replace('int', 'float')
-        aux = aux.replace("ufloat", "float").replace("floatc", "float")
-        if aux in ["float8", "float16"]:
-            aux = "float32"
-        warnings.warn("Casting data from %s to %s" % (data.dtype.name, aux))
-        resampled_data_dtype = np.dtype(aux)
-    else:
-        resampled_data_dtype = data.dtype
+    resampled_data_dtype = _get_resampled_dtype(data.dtype, interpolation)
 
     # Code is generic enough to work for both 3D and 4D images
     other_shape = data_shape[3:]
@@ -472,15 +780,83 @@ def resample_img(img, target_affine=None, target_shape=None,
 
     all_img = (slice(None), ) * 3
 
-    # Iter overr a set of 3D volumes, as the interpolation problem is
-    # separable in the extra dimensions. This reduces the
-    # computational cost
-    for ind in np.ndindex(*other_shape):
-        _resample_one_img(data[all_img + ind], A, A_inv, b, target_shape,
-                          interpolation_order,
-                          out=resampled_data[all_img + ind],
-                          copy=not input_img_is_string)
-
+    def resample(data, out):
+        if (interpolation_order == 0 or
+                (data.ndim > 3 and plan.diagonal and out.dtype.kind == 'f')):
+            # All volumes are resampled at once, with the indices (or
+            # weights) of the plan.
+            _resample_volumes(data, plan, interpolation_order, out=out,
+                              n_jobs=n_jobs)
+            return
+
+        # Iter overr a set of 3D volumes, as the interpolation problem is
+        # separable in the extra dimensions. This reduces the
+        # computational cost. ndimage releases the GIL: the volumes are
+        # resampled in parallel threads, writing in out.
+        def resample_volume(ind):
+            _resample_one_img(data[all_img + ind], affine_matrix, offset,
+                              target_shape, interpolation_order,
+                              out=out[all_img + ind])
+
+        _thread_map(resample_volume, np.ndindex(*data.shape[3:]),
+                    n_jobs=n_jobs)
+
+    # Nearest neighbor resampling copies non-finite values as they are
+    if interpolation_order == 0 or data.dtype.kind in ('i', 'u'):
+        resample(data, resampled_data)
+        return new_img_like(img, resampled_data, target_affine)
+    valid = np.isfinite(data)
+    if np.all(valid):
+        resample(data, resampled_data)
+        return new_img_like(img, resampled_data, target_affine)
+
+    warnings.warn("NaNs or infinite values are present in the data "
+                  "passed to resample. This is a bad thing as they "
+                  "make resampling ill-defined.",
+                  RuntimeWarning, stacklevel=2)
+    # Normalized convolution: the finite values, and their indicator, are
+    # resampled, and divided. Non-finite values are not extrapolated, and
+    # the nearest neighbors of non-finite values stay non-finite.
+    resample(np.where(valid, data, 0), resampled_data)
+
+    # Volumes with the same non-finite values, e.g. outside of the brain,
+    # share the resampling of their indicator
+    patterns = {}
+    first_volumes = []
+    volume_patterns = []
+    for ind in np.ndindex(*data.shape[3:]):
+        key = valid[all_img + ind].tostring()
+        if key not in patterns:
+            patterns[key] = len(first_volumes)
+            first_volumes.append(ind)
+        volume_patterns.append(patterns[key])
+    valid = np.concatenate([valid[all_img + ind][..., np.newaxis]
+                            for ind in first_volumes], axis=3)
+    weights = np.empty(target_shape + (len(first_volumes), ),
+                       dtype=resampled_data_dtype)
+    resample(valid.astype(resampled_data_dtype), weights)
+    # Outside of the input image, the resampled data is 0
+    weights[weights == 0] = 1
+    not_finite = np.empty(weights.shape, dtype=np.bool)
+    _resample_volumes(np.logical_not(valid), plan, 0, out=not_finite)
+
+    # Where the finite values have a small (or, with the overshoots of the
+    # splines, negative) weight, the division amplifies the values: the
+    # nearest neighbor, which is finite, is used instead.
+    small_weights = weights < .5
+    small_weights[not_finite] = False
+    if np.any(small_weights):
+        nearest = np.empty(resampled_data.shape, dtype=resampled_data_dtype)
+        _resample_volumes(data, plan, 0, out=nearest)
+    weights[small_weights] = 1
+
+    for ind, pattern in zip(np.ndindex(*data.shape[3:]), volume_patterns):
+        volume = resampled_data[all_img + ind]
+        volume /= weights[..., pattern]
+        volume[not_finite[..., pattern]] = np.nan
+        small = small_weights[..., pattern]
+        if np.any(small):
+            volume[small] = nearest[all_img + ind][small]
     return new_img_like(img, resampled_data, target_affine)
 
 
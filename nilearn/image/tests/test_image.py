@@ -7,6 +7,8 @@ from nose import SkipTest
 
 import platform
 import os
+import shutil
+import tempfile
 import nibabel
 import numpy as np
 from numpy.testing import assert_array_equal, assert_allclose
@@ -44,6 +46,22 @@ def test_high_variance_confounds():
                                                n_confounds=n_confounds)
     assert_true(confounds2.shape == (length, n_confounds))
 
+    # File-backed images are read by parts: the data is not loaded
+    tempdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tempdir, 'img.nii')
+        nibabel.save(img, filename)
+        img_from_file = nibabel.load(filename)
+        confounds3 = image.high_variance_confounds(img_from_file,
+                                                   percentile=10.,
+                                                   n_confounds=n_confounds)
+        assert_true(img_from_file._data_cache is None)
+        np.testing.assert_almost_equal(np.abs(confounds3),
+                                       np.abs(confounds2))
+        del img_from_file
+    finally:
+        shutil.rmtree(tempdir)
+
 
 def test__fast_smooth_array():
     N = 4
@@ -148,6 +166,12 @@ def test_smooth_img():
             assert_true(isinstance(out, nibabel.Nifti1Image))
             assert_true(out.shape == (shapes[0] + (lengths[0],)))
 
+            # Volumes filtered in parallel threads
+            for this_fwhm in (fwhm, 'fast'):
+                np.testing.assert_array_equal(
+                    image.smooth_img(imgs[0], this_fwhm, n_jobs=2).get_data(),
+                    image.smooth_img(imgs[0], this_fwhm).get_data())
+
 
 def test__crop_img_to():
     data = np.zeros((5, 6, 7))
@@ -194,6 +218,55 @@ def test_crop_img():
     assert_true(cropped_img.shape == (2 + 2, 4 + 2, 3 + 2))
 
 
+def test_file_backed_crop_and_index_img():
+    # The volumes or the part of the data needed are read from file-backed
+    # images, without loading the data
+    rng = np.random.RandomState(42)
+    data = np.zeros((5, 6, 7, 8))
+    data[2:4, 1:5, 3:6] = rng.rand(2, 4, 3, 8)
+    img = nibabel.Nifti1Image(data, np.eye(4))
+    tempdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tempdir, 'img.nii')
+        nibabel.save(img, filename)
+        img_from_file = nibabel.load(filename)
+        cropped_img = image.crop_img(img_from_file)
+        assert_array_equal(cropped_img.get_data(),
+                           image.crop_img(img).get_data())
+        for index in (3, slice(2, 5), [4, 1, 4], np.arange(8) % 3 == 1, []):
+            assert_array_equal(
+                image.index_img(img_from_file, index).get_data(),
+                data[..., index])
+        assert_true(img_from_file._data_cache is None)
+        del img_from_file
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_compressed_file_iter_and_index_img():
+    # The data of compressed files is loaded once, not read through the
+    # array proxy for each volume
+    rng = np.random.RandomState(42)
+    data = rng.rand(5, 6, 7, 8)
+    img = nibabel.Nifti1Image(data, np.eye(4))
+    tempdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tempdir, 'img.nii.gz')
+        nibabel.save(img, filename)
+        img_from_file = nibabel.load(filename)
+        volumes = list(image.iter_img(filename))
+        assert_true(len(volumes) == 8)
+        for i, volume in enumerate(volumes):
+            assert_array_equal(volume.get_data(), data[..., i])
+        assert_array_equal(
+            image.index_img(img_from_file, [4, 1, 4]).get_data(),
+            data[..., [4, 1, 4]])
+        assert_true(img_from_file._data_cache is not None)
+        del img_from_file
+    finally:
+        shutil.rmtree(tempdir)
+
+
 def test_crop_threshold_tolerance():
     """Check to see whether crop can skip values that are extremely
     close to zero in a relative sense and will crop them away"""
@@ -3,6 +3,7 @@ Test the resampling code.
 """
 import copy
 import math
+import warnings
 
 from nose import SkipTest
 from nose.tools import assert_equal, assert_raises, \
@@ -13,8 +14,10 @@ import numpy as np
 
 from nibabel import Nifti1Image
 
+import nilearn
+from nilearn.image import resampling
 from nilearn.image.resampling import resample_img, BoundingBoxError, \
-        reorder_img, from_matrix_vector, coord_transform
+        reorder_img, from_matrix_vector, coord_transform, _resample_masked
 from nilearn._utils import testing
 
 
@@ -377,7 +380,7 @@ def test_resampling_nan():
         core_data[2, 2:4, 1] = np.nan
         full_data_shape = np.array(core_shape) + 2
         full_data = np.zeros(full_data_shape)
-        full_data[[slice(1, 1 + s) for s in core_shape]] = core_data
+        full_data[tuple(slice(1, 1 + s) for s in core_shape)] = core_data
 
         source_img = Nifti1Image(full_data, np.eye(4))
 
@@ -424,6 +427,186 @@ def test_resampling_nan():
                 resampled_data[np.isfinite(resampled_data)])
 
 
+def test_resampling_nan_4d():
+    # 4D data, with a hole in all volumes and another in some of them: the
+    # volumes are resampled as the 3D volumes
+    data = 10 * np.ones((10, 10, 10, 3))
+    data[4:6, 4:6, 4:6] = np.nan
+    data[1:3, 1:3, 1:3, 1] = np.nan
+    source_img = Nifti1Image(data, 2 * np.eye(4))
+    for target_affine in (np.eye(4), rotation(0.3, 0.2)):
+        resampled_data = testing.assert_warns(
+            RuntimeWarning, resample_img, source_img,
+            target_affine=target_affine).get_data()
+        # Zeros outside of the input image
+        finite = resampled_data[np.isfinite(resampled_data)]
+        np.testing.assert_allclose(10, finite[finite != 0])
+        for n in range(3):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                resampled_volume = resample_img(
+                    Nifti1Image(data[..., n], 2 * np.eye(4)),
+                    target_affine=target_affine).get_data()
+            assert_array_equal(np.isfinite(resampled_data[..., n]),
+                               np.isfinite(resampled_volume))
+
+
+def test_resampling_nan_normalized_convolution():
+    # Non-constant data, with a hole and scattered NaNs: the finite values
+    # are interpolated without being amplified next to the NaNs
+    rng = np.random.RandomState(42)
+    x, y, z = np.indices((10, 11, 12))
+    data = 1 + (x + 2 * y + 3 * z) / 63.
+    data_min, data_max = data.min(), data.max()
+    data[(slice(3, 6), slice(4, 7), slice(5, 8))] = np.nan
+    data[rng.rand(*data.shape) < .3] = np.nan
+    source_img = Nifti1Image(data, 2 * np.eye(4))
+    for zoom in (3, .6):
+        # Target grid within the field of view of the data
+        target_shape = tuple(int((n - 1) * 2. / zoom) + 1
+                             for n in data.shape)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            resampled_data = resample_img(
+                source_img, target_affine=np.diag((zoom, zoom, zoom, 1)),
+                target_shape=target_shape).get_data()
+        finite = resampled_data[np.isfinite(resampled_data)]
+        assert_true(finite.size > 0)
+        assert_true(finite.min() > data_min - 1e-2)
+        assert_true(finite.max() < data_max + 1e-2)
+
+
+def test_resample_masked():
+    # Resampling only inside a mask must give the same values as resampling
+    # the whole image and masking it
+    rng = np.random.RandomState(42)
+    source_affine = np.eye(4)
+    source_affine[:3, :3] = 2 * rotation(0.3, 0.2)
+    data = rng.randn(10, 11, 12, 3)
+    # A non-finite value in one of the volumes
+    data[5, 5, 5, 1] = np.nan
+    target_affine = np.diag((1.5, 1.5, 1.5, 1))
+    target_affine[:3, 3] = [-4, -3, 2]
+    mask = rng.rand(8, 9, 10) > .5
+    mask_img = Nifti1Image(mask.astype(np.int8), target_affine)
+
+    for source_data in (data, (10 * data[..., ::2]).astype(np.int16)):
+        source_img = Nifti1Image(source_data, source_affine)
+        for interpolation in ('continuous', 'nearest'):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                series = _resample_masked(source_img, mask_img,
+                                          interpolation=interpolation)
+                resampled = resample_img(source_img,
+                                         target_affine=target_affine,
+                                         target_shape=mask.shape,
+                                         interpolation=interpolation)
+            resampled = resampled.get_data()[mask].T
+            assert_equal(series.dtype, resampled.dtype)
+            assert_array_almost_equal(series, resampled)
+
+
+def test_resample_4d_volumes():
+    # Resampling a 4D image must give the same volumes as resampling each
+    # volume separately
+    rng = np.random.RandomState(42)
+    data = rng.randn(10, 11, 12, 4)
+    source_img = Nifti1Image(data, np.eye(4))
+    # No coordinates half-way between two voxels: nearest neighbor would be
+    # ambiguous
+    zoom = np.diag((1.5, 2., .75, 1))
+    zoom[:3, 3] = [1.3, -2.2, 3.1]
+    rotated = np.eye(4)
+    rotated[:3, :3] = rotation(0.3, 0.2)
+    rotated[:3, 3] = [3, -2, 1]
+    for target_affine in (zoom, rotated):
+        for interpolation in ('continuous', 'nearest'):
+            resampled = resample_img(source_img, target_affine=target_affine,
+                                     target_shape=(9, 8, 14),
+                                     interpolation=interpolation)
+            resampled = resampled.get_data()
+            assert_equal(resampled.shape, (9, 8, 14, 4))
+            for n in range(4):
+                volume = resample_img(Nifti1Image(data[..., n], np.eye(4)),
+                                      target_affine=target_affine,
+                                      target_shape=(9, 8, 14),
+                                      interpolation=interpolation)
+                assert_array_almost_equal(resampled[..., n],
+                                          volume.get_data())
+            # Volumes resampled in parallel threads
+            threaded = resample_img(source_img, target_affine=target_affine,
+                                    target_shape=(9, 8, 14),
+                                    interpolation=interpolation, n_jobs=2)
+            assert_array_equal(threaded.get_data(), resampled)
+
+
+def test_resampling_plan_cache():
+    # Images with the same geometry share the same resampling plan
+    rng = np.random.RandomState(42)
+    source_affine = np.diag((2, 2, 2, 1))
+    target_affine = np.eye(4)
+    target_affine[:3, :3] = rotation(0.3, 0.2)
+    resampling.clear_resampling_cache()
+    for interpolation in ('continuous', 'nearest'):
+        for n in range(2):
+            img = Nifti1Image(rng.randn(10, 11, 12, 2), source_affine)
+            resampled = resample_img(img, target_affine=target_affine,
+                                     interpolation=interpolation)
+            assert_equal(len(resampling._resampling_plans), 1)
+            resampling.clear_resampling_cache()
+            expected = resample_img(img, target_affine=target_affine,
+                                    interpolation=interpolation)
+            assert_array_equal(resampled.get_data(), expected.get_data())
+            assert_array_equal(resampled.get_affine(),
+                               expected.get_affine())
+            # The affine of the resampled image is not the cached one
+            expected.get_affine()[:] = 0
+    # Least recently used plans are discarded
+    for n in range(resampling._RESAMPLING_PLANS_CACHE_SIZE + 1):
+        resample_img(Nifti1Image(np.zeros((5, 5, n + 1)), source_affine),
+                     target_affine=np.eye(4), interpolation='nearest')
+    assert_equal(len(resampling._resampling_plans),
+                 resampling._RESAMPLING_PLANS_CACHE_SIZE)
+    resampling.clear_resampling_cache()
+    assert_equal(len(resampling._resampling_plans), 0)
+
+
+def test_resampling_plan_cache_bytes():
+    # The arrays of the cached plans fit in nilearn.RESAMPLING_CACHE_BYTES
+    rng = np.random.RandomState(42)
+    source_affine = np.diag((2, 2, 2, 1))
+    resampling_cache_bytes = nilearn.RESAMPLING_CACHE_BYTES
+    resampling.clear_resampling_cache()
+    try:
+        # The nearest indices of each plan take 11 to 16 kB: a single plan
+        # is kept
+        nilearn.RESAMPLING_CACHE_BYTES = 20000
+        for n in range(3):
+            img = Nifti1Image(rng.randn(5, 5, n + 5, 2), source_affine)
+            resample_img(img, target_affine=np.eye(4),
+                         target_shape=(10, 11, 12),
+                         interpolation='nearest')
+            assert_equal(len(resampling._resampling_plans), 1)
+            assert_true(sum(plan.nbytes for plan in
+                            resampling._resampling_plans.values()) <=
+                        nilearn.RESAMPLING_CACHE_BYTES)
+        # Plans larger than the cache are not kept
+        nilearn.RESAMPLING_CACHE_BYTES = 0
+        resampled = resample_img(img, target_affine=np.eye(4),
+                                 target_shape=(10, 11, 12),
+                                 interpolation='nearest')
+        assert_equal(len(resampling._resampling_plans), 0)
+        nilearn.RESAMPLING_CACHE_BYTES = resampling_cache_bytes
+        assert_array_equal(
+            resampled.get_data(),
+            resample_img(img, target_affine=np.eye(4),
+                         target_shape=(10, 11, 12),
+                         interpolation='nearest').get_data())
+    finally:
+        nilearn.RESAMPLING_CACHE_BYTES = resampling_cache_bytes
+        resampling.clear_resampling_cache()
+
+
 def test_reorder_img():
     # We need to test on a square array, as rotation does not change
     # shape, whereas reordering does.
@@ -10,7 +10,7 @@ import abc
 import numpy as np
 
 from sklearn.base import BaseEstimator, TransformerMixin
-from sklearn.externals.joblib import Memory
+from sklearn.externals.joblib import Memory, Parallel, delayed
 
 from .. import masking
 from .. import image
@@ -18,7 +18,7 @@ from .. import signal
 from .. import _utils
 from .._utils.cache_mixin import CacheMixin, cache
 from .._utils.class_inspect import enclosing_scope_name
-from .._utils.compat import _basestring
+from .._utils.compat import _basestring, izip
 
 
 def filter_and_extract(imgs, extraction_function,
@@ -26,7 +26,8 @@ def filter_and_extract(imgs, extraction_function,
                        memory_level=0, memory=Memory(cachedir=None),
                        verbose=0,
                        confounds=None,
-                       copy=True):
+                       copy=True,
+                       cleaning_plan=None):
     """Extract representative time series using given function.
 
     Parameters
@@ -42,6 +43,10 @@ def filter_and_extract(imgs, extraction_function,
         If any other parameter is needed, a functor or a partial
         function must be provided.
 
+    cleaning_plan: nilearn.signal.CleaningPlan, optional
+        Precomputed cleaning, built from the parameters. If given, it is used
+        to clean the extracted signals instead of signal.clean.
+
     For all other parameters refer to NiftiMasker documentation
 
     Returns
@@ -65,10 +70,6 @@ def filter_and_extract(imgs, extraction_function,
             _utils._repr_niimgs(imgs)[:200]))
     imgs = _utils.check_niimg(imgs, atleast_4d=True, ensure_ndim=4)
 
-    sample_mask = parameters.get('sample_mask')
-    if sample_mask is not None:
-        imgs = image.index_img(imgs, sample_mask)
-
     target_shape = parameters.get('target_shape')
     target_affine = parameters.get('target_affine')
     if target_shape is not None or target_affine is not None:
@@ -97,6 +98,12 @@ def filter_and_extract(imgs, extraction_function,
                                 func_memory_level=2,
                                 memory_level=memory_level)(imgs)
 
+    # Samples are selected on the extracted signals, rather than on the
+    # images: the 4D data is not copied.
+    sample_mask = parameters.get('sample_mask')
+    if sample_mask is not None:
+        region_signals = region_signals[sample_mask]
+
     # Temporal
     # ========
     # Detrending (optional)
@@ -107,6 +114,14 @@ def filter_and_extract(imgs, extraction_function,
     if verbose > 0:
         print("[%s] Cleaning extracted signals" % class_name)
     sessions = parameters.get('sessions')
+    if cleaning_plan is not None:
+        region_signals = cache(
+            _clean_with_plan, memory=memory, func_memory_level=2,
+            memory_level=memory_level)(
+                region_signals, cleaning_plan, confounds=confounds,
+                sessions=sessions)
+        return region_signals, aux
+
     region_signals = cache(
         signal.clean, memory=memory, func_memory_level=2,
         memory_level=memory_level)(
@@ -117,11 +132,23 @@ def filter_and_extract(imgs, extraction_function,
             low_pass=parameters['low_pass'],
             high_pass=parameters['high_pass'],
             confounds=confounds,
-            sessions=sessions)
+            sessions=sessions,
+            dtype=parameters.get('dtype'))
 
     return region_signals, aux
 
 
+def _clean_with_plan(signals, cleaning_plan, confounds=None, sessions=None):
+    """Clean signals with a signal.CleaningPlan (cacheable function)."""
+    return cleaning_plan.transform(signals, confounds=confounds,
+                                   sessions=sessions)
+
+
+def _transform_single_imgs(masker, imgs, confounds):
+    """Picklable wrapper around masker.transform_single_imgs."""
+    return masker.transform_single_imgs(imgs, confounds)
+
+
 class BaseMasker(BaseEstimator, TransformerMixin, CacheMixin):
     """Base class for NiftiMaskers
     """
@@ -150,6 +177,22 @@ class BaseMasker(BaseEstimator, TransformerMixin, CacheMixin):
         """
         raise NotImplementedError()
 
+    def _get_cleaning_plan(self):
+        """Return the cleaning plan for the current parameters.
+
+        The plan is built once and reused by all calls to transform, as
+        long as the cleaning parameters are not changed.
+        """
+        params = dict((name, getattr(self, name))
+                      for name in ('detrend', 'standardize', 'low_pass',
+                                   'high_pass', 't_r', 'dtype'))
+        plan = getattr(self, '_cleaning_plan_', None)
+        if plan is None or any(getattr(plan, name) != value
+                               for name, value in params.items()):
+            plan = signal.CleaningPlan(**params)
+            self._cleaning_plan_ = plan
+        return plan
+
     def transform(self, imgs, confounds=None):
         """Apply mask, spatial and temporal preprocessing
 
@@ -175,6 +218,52 @@ class BaseMasker(BaseEstimator, TransformerMixin, CacheMixin):
 
         return self.transform_single_imgs(imgs, confounds)
 
+    def transform_imgs(self, imgs_list, confounds=None, n_jobs=1):
+        """Extract signals from a list of 4D niimgs, in parallel.
+
+        Parameters
+        ----------
+        imgs_list: list of Niimg-like objects
+            See http://nilearn.github.io/building_blocks/manipulating_mr_images.html#niimg.
+            List of images to process. One item per subject.
+
+        confounds: list of confounds, optional
+            List of confounds (2D arrays or filenames pointing to CSV
+            files). Must be of same length than imgs_list.
+
+        n_jobs: integer, optional
+            The number of cpus to use to do the computation. -1 means
+            'all cpus'.
+
+        Returns
+        -------
+        region_signals: list of 2D numpy.ndarray
+            List of signal for each element per subject, in the order of
+            imgs_list.
+            shape: list of (number of scans, number of elements)
+        """
+        self._check_fitted()
+
+        if confounds is None:
+            confounds = [None] * len(imgs_list)
+        elif len(confounds) != len(imgs_list):
+            raise ValueError("confounds must have the same length as "
+                             "imgs_list: %i != %i"
+                             % (len(confounds), len(imgs_list)))
+        if len(imgs_list) == 0:
+            return []
+
+        # The first subject is processed here: it prepares (resamples and
+        # indexes) the regions, so that the workers reuse them. Large
+        # arrays of the fitted masker are then memory-mapped by joblib and
+        # shared between workers, instead of being copied for each subject.
+        region_signals = [self.transform_single_imgs(imgs_list[0],
+                                                     confounds[0])]
+        region_signals.extend(Parallel(n_jobs=n_jobs)(
+            delayed(_transform_single_imgs)(self, imgs, cfs)
+            for imgs, cfs in izip(imgs_list[1:], confounds[1:])))
+        return region_signals
+
     def fit_transform(self, X, y=None, confounds=None, **fit_params):
         """Fit to data, then transform it
 
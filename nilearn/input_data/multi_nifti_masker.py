@@ -7,7 +7,10 @@ Transformer used to apply basic transformations on multi subject MRI data.
 import warnings
 import collections
 import itertools
+import os
+import tempfile
 
+import numpy as np
 from sklearn.externals.joblib import Memory, Parallel, delayed
 
 from .. import masking
@@ -20,6 +23,17 @@ from .._utils.niimg_conversions import _iter_check_niimg
 from .._utils.class_inspect import get_params
 
 
+def _filter_and_mask_to_file(filename, func, *args, **kwargs):
+    """Run func (filter_and_mask) and save the masked data in filename.
+
+    Only the file name is sent back to the parent process, instead of the
+    data itself.
+    """
+    data, _ = func(*args, **kwargs)
+    np.save(filename, data)
+    return filename
+
+
 class MultiNiftiMasker(NiftiMasker, CacheMixin):
     """Class for masking of Niimg-like objects.
 
@@ -80,6 +94,12 @@ class MultiNiftiMasker(NiftiMasker, CacheMixin):
         to fine-tune mask computation. Please see the related documentation
         for details.
 
+    dtype: numpy dtype, optional
+        Floating point type of the masked data, also used for its cleaning
+        by signal.clean. np.float32 halves memory usage, at the cost of
+        precision. By default, float32 is used unless the images are in
+        double precision.
+
     memory: instance of joblib.Memory or string
         Used to cache the masking process.
         By default, no caching is done. If a string is given, it is the
@@ -119,7 +139,7 @@ class MultiNiftiMasker(NiftiMasker, CacheMixin):
                  standardize=False, detrend=False,
                  low_pass=None, high_pass=None, t_r=None,
                  target_affine=None, target_shape=None,
-                 mask_strategy='background', mask_args=None,
+                 mask_strategy='background', mask_args=None, dtype=None,
                  memory=Memory(cachedir=None), memory_level=0,
                  n_jobs=1, verbose=0
                  ):
@@ -136,6 +156,7 @@ class MultiNiftiMasker(NiftiMasker, CacheMixin):
         self.target_shape = target_shape
         self.mask_strategy = mask_strategy
         self.mask_args = mask_args
+        self.dtype = dtype
 
         self.memory = memory
         self.memory_level = memory_level
@@ -212,9 +233,12 @@ class MultiNiftiMasker(NiftiMasker, CacheMixin):
             self.affine_ = self.mask_img_.get_affine()
         # Load data in memory
         self.mask_img_.get_data()
+        # Forget the samples seen by partial_transform
+        self._online_cleaner_ = None
         return self
 
-    def transform_imgs(self, imgs_list, confounds=None, copy=True, n_jobs=1):
+    def transform_imgs(self, imgs_list, confounds=None, copy=True, n_jobs=1,
+                       memmap_dir=None):
         """Prepare multi subject data in parallel
 
         Parameters
@@ -235,7 +259,13 @@ class MultiNiftiMasker(NiftiMasker, CacheMixin):
         n_jobs: integer, optional
             The number of cpus to use to do the computation. -1 means
             'all cpus'.
-        
+
+        memmap_dir: str, optional
+            If given, the data of each subject is saved in a .npy file in
+            this directory, and returned as a read-only memory-mapped array.
+            This makes it possible to process datasets that do not fit in
+            memory. Files are not deleted by nilearn.
+
         Returns
         -------
         region_signals: list of 2D numpy.ndarray
@@ -271,13 +301,39 @@ class MultiNiftiMasker(NiftiMasker, CacheMixin):
 
         func = self._cache(filter_and_mask,
                           ignore=['verbose', 'memory', 'memory_level', 'copy'])
+        # Filter coefficients are computed once for all subjects
+        cleaning_plan = self._get_cleaning_plan()
+        if memmap_dir is not None:
+            # Unique file names, not to overwrite data still in use
+            filenames = []
+            for n in range(len(imgs_list)):
+                fd, filename = tempfile.mkstemp(prefix='subject_%03i_' % n,
+                                                suffix='.npy',
+                                                dir=memmap_dir)
+                os.close(fd)
+                filenames.append(filename)
+            filenames = Parallel(n_jobs=n_jobs)(
+                delayed(_filter_and_mask_to_file)(
+                    filename, func, imgs, self.mask_img_, params,
+                    memory_level=self.memory_level,
+                    memory=self.memory,
+                    verbose=self.verbose,
+                    confounds=cfs,
+                    copy=copy,
+                    cleaning_plan=cleaning_plan)
+                for filename, imgs, cfs in izip(filenames, niimg_iter,
+                                                confounds))
+            return [np.load(filename, mmap_mode='r')
+                    for filename in filenames]
+
         data = Parallel(n_jobs=n_jobs)(
             delayed(func)(imgs, self.mask_img_, params,
                            memory_level=self.memory_level,
                            memory=self.memory,
                            verbose=self.verbose,
                            confounds=cfs,
-                           copy=copy)
+                           copy=copy,
+                           cleaning_plan=cleaning_plan)
             for imgs, cfs in izip(niimg_iter, confounds))
         return [d[0] for d in data]
 
@@ -20,14 +20,12 @@ class _ExtractionFunctor(object):
 
     func_name = 'nifti_labels_masker_extractor'
 
-    def __init__(self, _resampled_labels_img_, background_label):
-        self._resampled_labels_img_ = _resampled_labels_img_
-        self.background_label = background_label
+    def __init__(self, _labels_index_):
+        self._labels_index_ = _labels_index_
 
     def __call__(self, imgs):
-        return region.img_to_signals_labels(
-            imgs, self._resampled_labels_img_,
-            background_label=self.background_label)
+        return (self._labels_index_.img_to_signals(imgs),
+                self._labels_index_.labels)
 
 
 class NiftiLabelsMasker(BaseMasker, CacheMixin):
@@ -75,6 +73,10 @@ class NiftiLabelsMasker(BaseMasker, CacheMixin):
         This parameter is passed to signal.clean. Please see the related
         documentation for details
 
+    dtype: numpy dtype, optional
+        This parameter is passed to signal.clean. Please see the related
+        documentation for details
+
     resampling_target: {"data", "labels", None}, optional.
         Gives which image gives the final shape/size. For example, if
         `resampling_target` is "data", the atlas is resampled to the
@@ -103,7 +105,7 @@ class NiftiLabelsMasker(BaseMasker, CacheMixin):
 
     def __init__(self, labels_img, background_label=0, mask_img=None,
                  smoothing_fwhm=None, standardize=False, detrend=False,
-                 low_pass=None, high_pass=None, t_r=None,
+                 low_pass=None, high_pass=None, t_r=None, dtype=None,
                  resampling_target="data",
                  memory=Memory(cachedir=None, verbose=0), memory_level=1,
                  verbose=0):
@@ -120,6 +122,7 @@ class NiftiLabelsMasker(BaseMasker, CacheMixin):
         self.low_pass = low_pass
         self.high_pass = high_pass
         self.t_r = t_r
+        self.dtype = dtype
 
         # Parameters for resampling
         self.resampling_target = resampling_target
@@ -182,6 +185,22 @@ class NiftiLabelsMasker(BaseMasker, CacheMixin):
 
             mask_data, mask_affine = masking._load_mask_img(self.mask_img_)
 
+        # Index the regions once, to reuse it for every transform and
+        # inverse_transform.
+        self._resampled_labels_img_ = self.labels_img_
+        self._labels_index_ = region._LabelsIndex(
+            self.labels_img_, background_label=self.background_label)
+        if self.mask_img_ is None:
+            self._inverse_labels_index_ = self._labels_index_
+        elif _check_same_fov(self.mask_img_, self.labels_img_):
+            self._inverse_labels_index_ = region._LabelsIndex(
+                self.labels_img_, background_label=self.background_label,
+                mask_img=self.mask_img_)
+        else:
+            # The mask is not in the labels space: inverse_transform
+            # will fail.
+            self._inverse_labels_index_ = None
+
         return self
 
     def fit_transform(self, imgs, confounds=None):
@@ -217,8 +236,6 @@ class NiftiLabelsMasker(BaseMasker, CacheMixin):
         # We handle the resampling of labels separately because the affine of
         # the labels image should not impact the extraction of the signal.
 
-        if not hasattr(self, '_resampled_labels_img_'):
-            self._resampled_labels_img_ = self.labels_img_
         if self.resampling_target == "data":
             imgs_ = _utils.check_niimg_4d(imgs)
             if not _check_same_fov(imgs_, self._resampled_labels_img_):
@@ -229,6 +246,9 @@ class NiftiLabelsMasker(BaseMasker, CacheMixin):
                         self.labels_img_, interpolation="nearest",
                         target_shape=imgs_.shape[:3],
                         target_affine=imgs_.get_affine())
+                self._labels_index_ = region._LabelsIndex(
+                    self._resampled_labels_img_,
+                    background_label=self.background_label)
 
         target_shape = None
         target_affine = None
@@ -245,11 +265,11 @@ class NiftiLabelsMasker(BaseMasker, CacheMixin):
                 filter_and_extract,
                 ignore=['verbose', 'memory', 'memory_level'])(
             # Images
-            imgs, _ExtractionFunctor(self._resampled_labels_img_,
-                                     self.background_label),
+            imgs, _ExtractionFunctor(self._labels_index_),
             # Pre-processing
             params,
             confounds=confounds,
+            cleaning_plan=self._get_cleaning_plan(),
             # Caching
             memory=self.memory,
             memory_level=self.memory_level,
@@ -279,6 +299,9 @@ class NiftiLabelsMasker(BaseMasker, CacheMixin):
         self._check_fitted()
 
         logger.log("computing image from signals", verbose=self.verbose)
-        return region.signals_to_img_labels(
-            signals, self.labels_img_, self.mask_img_,
-            background_label=self.background_label)
+        if self._inverse_labels_index_ is None:
+            # Raises an informative error
+            return region.signals_to_img_labels(
+                signals, self.labels_img_, self.mask_img_,
+                background_label=self.background_label)
+        return self._inverse_labels_index_.signals_to_img(signals)
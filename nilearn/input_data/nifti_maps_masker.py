@@ -19,14 +19,12 @@ class _ExtractionFunctor(object):
 
     func_name = 'nifti_maps_masker_extractor'
 
-    def __init__(self, _resampled_maps_img_, _resampled_mask_img_):
-        self._resampled_maps_img_ = _resampled_maps_img_
-        self._resampled_mask_img_ = _resampled_mask_img_
+    def __init__(self, _sparse_maps_):
+        self._sparse_maps_ = _sparse_maps_
 
     def __call__(self, imgs):
-            return region.img_to_signals_maps(
-                imgs, self._resampled_maps_img_,
-                mask_img=self._resampled_mask_img_)
+        return (self._sparse_maps_.img_to_signals(imgs),
+                self._sparse_maps_.labels)
 
 
 class NiftiMapsMasker(BaseMasker, CacheMixin):
@@ -75,6 +73,10 @@ class NiftiMapsMasker(BaseMasker, CacheMixin):
         This parameter is passed to signal.clean. Please see the related
         documentation for details
 
+    dtype: numpy dtype, optional
+        This parameter is passed to signal.clean. Please see the related
+        documentation for details
+
     resampling_target: {"mask", "maps", None} optional.
         Gives which image gives the final shape/size. For example, if
         `resampling_target` is "mask" then maps_img and images provided to
@@ -110,7 +112,7 @@ class NiftiMapsMasker(BaseMasker, CacheMixin):
     def __init__(self, maps_img, mask_img=None,
                  allow_overlap=True,
                  smoothing_fwhm=None, standardize=False, detrend=False,
-                 low_pass=None, high_pass=None, t_r=None,
+                 low_pass=None, high_pass=None, t_r=None, dtype=None,
                  resampling_target="data",
                  memory=Memory(cachedir=None, verbose=0), memory_level=0,
                  verbose=0):
@@ -129,6 +131,7 @@ class NiftiMapsMasker(BaseMasker, CacheMixin):
         self.low_pass = low_pass
         self.high_pass = high_pass
         self.t_r = t_r
+        self.dtype = dtype
 
         # Parameters for resampling
         self.resampling_target = resampling_target
@@ -193,6 +196,12 @@ class NiftiMapsMasker(BaseMasker, CacheMixin):
                 interpolation="nearest",
                 copy=True)
 
+        self._resampled_maps_img_ = self.maps_img_
+        self._resampled_mask_img_ = self.mask_img_
+        # Sparse versions of the maps, built on first use
+        self._sparse_maps_ = None
+        self._inverse_sparse_maps_ = None
+
         return self
 
     def _check_fitted(self):
@@ -229,11 +238,6 @@ class NiftiMapsMasker(BaseMasker, CacheMixin):
         # affine of the maps and mask images should not impact the extraction
         # of the signal.
 
-        if not hasattr(self, '_resampled_maps_img_'):
-            self._resampled_maps_img_ = self.maps_img_
-        if not hasattr(self, '_resampled_mask_img_'):
-            self._resampled_mask_img_ = self.mask_img_
-
         if self.resampling_target is None:
             imgs_ = _utils.check_niimg_4d(imgs)
             images = dict(maps=self.maps_img_, data=imgs_)
@@ -268,22 +272,32 @@ class NiftiMapsMasker(BaseMasker, CacheMixin):
                         target_shape=ref_img.shape[:3],
                         target_affine=ref_img.get_affine())
 
-        if not self.allow_overlap:
-            # Check if there is an overlap.
-
-            # If float, we set low values to 0
-            dtype = _get_data_dtype(self._resampled_maps_img_)
-            data = self._resampled_maps_img_.get_data()
-            if dtype.kind == 'f':
-                data[data < np.finfo(dtype).eps] = 0.
-
-            # Check the overlaps
-            if np.any(np.sum(data > 0., axis=3) > 1):
-                raise ValueError(
-                    'Overlap detected in the maps. The overlap may be '
-                    'due to the atlas itself or possibly introduced by '
-                    'resampling'
-                )
+        # The sparse maps only have to be rebuilt, and checked for overlaps,
+        # when the maps or the mask have been resampled.
+        sparse_maps = self._sparse_maps_
+        if (sparse_maps is None
+                or sparse_maps.maps_img is not self._resampled_maps_img_
+                or sparse_maps.mask_img is not self._resampled_mask_img_):
+            if not self.allow_overlap:
+                # Check if there is an overlap.
+
+                # If float, we set low values to 0
+                dtype = _get_data_dtype(self._resampled_maps_img_)
+                data = self._resampled_maps_img_.get_data()
+                if dtype.kind == 'f':
+                    data[data < np.finfo(dtype).eps] = 0.
+
+                # Check the overlaps
+                if np.any(np.sum(data > 0., axis=3) > 1):
+                    raise ValueError(
+                        'Overlap detected in the maps. The overlap may be '
+                        'due to the atlas itself or possibly introduced by '
+                        'resampling'
+                    )
+
+            self._sparse_maps_ = region._SparseMaps(
+                self._resampled_maps_img_,
+                mask_img=self._resampled_mask_img_)
 
         target_shape = None
         target_affine = None
@@ -299,11 +313,11 @@ class NiftiMapsMasker(BaseMasker, CacheMixin):
         region_signals, labels_ = self._cache(
             filter_and_extract, ignore=['verbose', 'memory', 'memory_level'])(
                 # Images
-                imgs, _ExtractionFunctor(self._resampled_maps_img_,
-                                         self._resampled_mask_img_),
+                imgs, _ExtractionFunctor(self._sparse_maps_),
                 # Pre-treatments
                 params,
                 confounds=confounds,
+                cleaning_plan=self._get_cleaning_plan(),
                 # Caching
                 memory=self.memory,
                 memory_level=self.memory_level,
@@ -332,5 +346,7 @@ class NiftiMapsMasker(BaseMasker, CacheMixin):
         self._check_fitted()
 
         logger.log("computing image from signals", verbose=self.verbose)
-        return region.signals_to_img_maps(region_signals, self.maps_img_,
-                                          mask_img=self.mask_img_)
+        if self._inverse_sparse_maps_ is None:
+            self._inverse_sparse_maps_ = region._SparseMaps(
+                self.maps_img_, mask_img=self.mask_img_)
+        return self._inverse_sparse_maps_.signals_to_img(region_signals)
@@ -5,13 +5,17 @@ Transformer used to apply basic transformations on MRI data.
 # License: simplified BSD
 
 from copy import copy as copy_object
+
+import numpy as np
 from sklearn.externals.joblib import Memory
 
 from .. import masking
 from .. import image
+from .. import signal
 from .. import _utils
 from .._utils import CacheMixin
 from .._utils.class_inspect import get_params
+from ..image.resampling import _resample_masked
 from .base_masker import BaseMasker, filter_and_extract
 from nilearn._utils.niimg_conversions import _check_same_fov
 
@@ -20,18 +24,38 @@ class _ExtractionFunctor(object):
 
     func_name = 'nifti_masker_extractor'
 
-    def __init__(self, mask_img_):
+    def __init__(self, mask_img_, smoothing_fwhm=None, chunk_size=None,
+                 resample=False, dtype=None):
         self.mask_img_ = mask_img_
+        self.smoothing_fwhm = smoothing_fwhm
+        self.chunk_size = chunk_size
+        self.resample = resample
+        self.dtype = dtype
 
     def __call__(self, imgs):
-        return masking.apply_mask(imgs, self.mask_img_), imgs.get_affine()
+        if self.resample:
+            # Resample imgs only inside the mask, and finish as apply_mask
+            series = _resample_masked(imgs, self.mask_img_)
+            if self.dtype is not None:
+                series = series.astype(self.dtype)
+            elif series.dtype.kind != 'f':
+                series = series.astype(np.float32)
+            series[np.logical_not(np.isfinite(series))] = 0
+            return series, self.mask_img_.get_affine()
+        return (masking.apply_mask(imgs, self.mask_img_,
+                                   dtype=('f' if self.dtype is None
+                                          else self.dtype),
+                                   smoothing_fwhm=self.smoothing_fwhm,
+                                   chunk_size=self.chunk_size),
+                imgs.get_affine())
 
 
 def filter_and_mask(imgs, mask_img_, parameters,
                     memory_level=0, memory=Memory(cachedir=None),
                     verbose=0,
                     confounds=None,
-                    copy=True):
+                    copy=True,
+                    cleaning_plan=None):
 
     imgs = _utils.check_niimg(imgs, atleast_4d=True, ensure_ndim=4)
 
@@ -42,15 +66,38 @@ def filter_and_mask(imgs, mask_img_, parameters,
         parameters = copy_object(parameters)
         # now we can crop
         mask_img_ = image.crop_img(mask_img_, copy=False)
-        parameters['target_shape'] = mask_img_.shape
-        parameters['target_affine'] = mask_img_.get_affine()
-
-    data, affine = filter_and_extract(imgs, _ExtractionFunctor(mask_img_),
+        if parameters.get('smoothing_fwhm') is None:
+            # Without smoothing, only voxels inside the mask need to be
+            # resampled: resampling and masking are done at once.
+            parameters['target_shape'] = None
+            parameters['target_affine'] = None
+            extraction_function = _ExtractionFunctor(
+                mask_img_, resample=True, dtype=parameters.get('dtype'))
+        else:
+            parameters['target_shape'] = mask_img_.shape
+            parameters['target_affine'] = mask_img_.get_affine()
+            extraction_function = _ExtractionFunctor(
+                mask_img_, dtype=parameters.get('dtype'))
+    else:
+        # No resampling is needed: smoothing is done while masking, only on
+        # the bounding box of the mask (and, if chunk_size is given, by
+        # blocks of volumes)
+        parameters = copy_object(parameters)
+        extraction_function = _ExtractionFunctor(
+            mask_img_, smoothing_fwhm=parameters['smoothing_fwhm'],
+            chunk_size=parameters.get('chunk_size'),
+            dtype=parameters.get('dtype'))
+        parameters['smoothing_fwhm'] = None
+        parameters['target_shape'] = None
+        parameters['target_affine'] = None
+
+    data, affine = filter_and_extract(imgs, extraction_function,
                                       parameters,
                                       memory_level=memory_level,
                                       memory=memory,
                                       verbose=verbose,
-                                      confounds=confounds, copy=copy)
+                                      confounds=confounds, copy=copy,
+                                      cleaning_plan=cleaning_plan)
 
     # For _later_: missing value removal or imputing of missing data
     # (i.e. we want to get rid of NaNs, if smoothing must be done
@@ -132,6 +179,18 @@ class NiftiMasker(BaseMasker, CacheMixin):
         This is useful to perform data subselection as part of a scikit-learn
         pipeline.
 
+    chunk_size : int, optional
+        If given, and if no resampling of the images is needed, the images
+        are read, smoothed and masked by blocks of chunk_size volumes.
+        Images stored on disk are then never fully loaded in memory: peak
+        memory usage scales with chunk_size instead of the number of scans.
+
+    dtype : numpy dtype, optional
+        Floating point type of the masked data, also used for its cleaning
+        by signal.clean. np.float32 halves memory usage, at the cost of
+        precision. By default, float32 is used unless the images are in
+        double precision.
+
     memory : instance of joblib.Memory or string
         Used to cache the masking process.
         By default, no caching is done. If a string is given, it is the
@@ -166,8 +225,8 @@ class NiftiMasker(BaseMasker, CacheMixin):
                  low_pass=None, high_pass=None, t_r=None,
                  target_affine=None, target_shape=None,
                  mask_strategy='background',
-                 mask_args=None, sample_mask=None,
-                 memory_level=1, memory=Memory(cachedir=None),
+                 mask_args=None, sample_mask=None, chunk_size=None,
+                 dtype=None, memory_level=1, memory=Memory(cachedir=None),
                  verbose=0
                  ):
         # Mask is provided or computed
@@ -180,11 +239,13 @@ class NiftiMasker(BaseMasker, CacheMixin):
         self.low_pass = low_pass
         self.high_pass = high_pass
         self.t_r = t_r
+        self.dtype = dtype
         self.target_affine = target_affine
         self.target_shape = target_shape
         self.mask_strategy = mask_strategy
         self.mask_args = mask_args
         self.sample_mask = sample_mask
+        self.chunk_size = chunk_size
 
         self.memory = memory
         self.memory_level = memory_level
@@ -248,6 +309,8 @@ class NiftiMasker(BaseMasker, CacheMixin):
             self.affine_ = self.mask_img_.get_affine()
         # Load data in memory
         self.mask_img_.get_data()
+        # Forget the samples seen by partial_transform
+        self._online_cleaner_ = None
         if self.verbose > 10:
             print("[%s.fit] Finished fit" % self.__class__.__name__)
         return self
@@ -287,6 +350,50 @@ class NiftiMasker(BaseMasker, CacheMixin):
                                     memory=self.memory,
                                     verbose=self.verbose,
                                     confounds=confounds,
-                                    copy=copy
+                                    copy=copy,
+                                    cleaning_plan=self._get_cleaning_plan()
         )
         return data
+
+    def partial_transform(self, imgs, confounds=None):
+        """Mask and clean new volumes, e.g. in real-time experiments.
+
+        Volumes are cleaned with all the volumes given to partial_transform
+        since the last call to fit (see nilearn.signal.OnlineCleaner). Only
+        detrending, standardization and confounds removal are applied:
+        temporal filtering is not available.
+
+        Parameters
+        ----------
+        imgs: 3D/4D Niimg-like object
+            See http://nilearn.github.io/building_blocks/manipulating_mr_images.html#niimg.
+            New volumes. They must be in the space of the mask.
+
+        confounds: CSV file or array-like, optional
+            Confounds of the new volumes.
+            shape: (number of new scans, number of confounds)
+
+        Returns
+        -------
+        region_signals: 2D numpy.ndarray
+            Cleaned signal of the new volumes for each voxel inside the
+            mask.
+            shape: (number of new scans, number of voxels)
+        """
+        self._check_fitted()
+        if self.low_pass is not None or self.high_pass is not None:
+            raise ValueError("Temporal filtering is not available in "
+                             "partial_transform: low_pass and high_pass "
+                             "must be None.")
+        imgs = _utils.check_niimg(imgs, atleast_4d=True, ensure_ndim=4)
+        data = masking._apply_mask_fmri(
+            imgs, self.mask_img_, smoothing_fwhm=self.smoothing_fwhm,
+            dtype=('f' if self.dtype is None else self.dtype))
+
+        cleaner = getattr(self, '_online_cleaner_', None)
+        if cleaner is None:
+            cleaner = signal.OnlineCleaner(detrend=self.detrend,
+                                           standardize=self.standardize)
+            self._online_cleaner_ = cleaner
+        cleaner.partial_fit(data, confounds=confounds)
+        return cleaner.transform(data, confounds=confounds)
@@ -4,10 +4,8 @@ Transformer for computing seeds signals.
 Mask nifti images by spherical volumes for seed-region analyses
 """
 import numpy as np
-import sklearn
-from sklearn import neighbors
+from scipy import linalg, sparse
 from sklearn.externals.joblib import Memory
-from distutils.version import LooseVersion
 
 from .._utils import CacheMixin
 from .._utils.niimg_conversions import check_niimg_4d, check_niimg_3d
@@ -17,9 +15,13 @@ from .. import masking
 from .base_masker import filter_and_extract, BaseMasker
 
 
-def _iter_signals_from_spheres(seeds, niimg, radius, allow_overlap,
-                               mask_img=None):
-    """Utility function to iterate over spheres.
+def _spheres_index(seeds, affine, shape, radius, allow_overlap,
+                   mask=None):
+    """Compute the voxels in each sphere, for a given image geometry.
+
+    The voxels of each sphere are found by scanning the bounding box of the
+    sphere in voxel space, so that the cost does not depend on the size of
+    the image.
 
     Parameters
     ==========
@@ -27,94 +29,102 @@ def _iter_signals_from_spheres(seeds, niimg, radius, allow_overlap,
         Seed definitions. List of coordinates of the seeds in the same space
         as the images (typically MNI or TAL).
 
-    imgs: 3D/4D Niimg-like object
-        See http://nilearn.github.io/building_blocks/manipulating_mr_images.html#niimg.
-        Images to process. It must boil down to a 4D image with scans
-        number as last dimension.
+    affine: numpy.ndarray
+        affine of the images to process.
+
+    shape: tuple
+        3D shape of the images to process.
 
     radius: float, optional
         Indicates, in millimeters, the radius for the sphere around the seed.
-        Default is None (signal is extracted on a single voxel).
+        If None, signal is extracted on a single voxel.
 
     allow_overlap: boolean
-        If False, an error is raised if the maps overlaps (ie at least two
-        maps have a non-zero value for the same voxel). Default is False.
-
-    mask_img: Niimg-like object, optional
-        See http://nilearn.github.io/building_blocks/manipulating_mr_images.html#niimg.
-        Mask to apply to regions before extracting signals.
+        If False, an error is raised if the spheres overlap.
+
+    mask: numpy.ndarray, optional
+        boolean array of the same shape as images. Voxels outside the mask
+        are discarded.
+
+    Returns
+    =======
+    voxels: numpy.ndarray
+        flat (C order) indices of the voxels belonging to at least one
+        sphere.
+
+    spheres: scipy.sparse.csr_matrix
+        adjacency matrix between seeds and voxels: spheres[i, j] is one if
+        voxels[j] is in the sphere around seeds[i], zero otherwise.
+        shape: (number of seeds, len(voxels))
     """
-    seeds = list(seeds)
-    affine = niimg.get_affine()
-
-    # Compute world coordinates of all in-mask voxels.
-
-    if mask_img is not None:
-        mask_img = check_niimg_3d(mask_img)
-        mask_img = image.resample_img(mask_img, target_affine=affine,
-                                      target_shape=niimg.shape[:3],
-                                      interpolation='nearest')
-        mask, _ = masking._load_mask_img(mask_img)
-        mask_coords = list(np.where(mask != 0))
-
-        X = masking._apply_mask_fmri(niimg, mask_img)
-    else:
-        mask_coords = list(zip(*np.ndindex(niimg.shape[:3])))
-        X = niimg.get_data().reshape([-1, niimg.shape[3]]).T
-    mask_coords.append(np.ones(len(mask_coords[0]), dtype=np.int))
-    mask_coords = np.asarray(mask_coords)
-    mask_coords = np.dot(affine, mask_coords)[:3].T
-
-    if (radius is not None and
-            LooseVersion(sklearn.__version__) < LooseVersion('0.16')):
-        # Fix for scikit learn versions below 0.16. See
-        # https://github.com/scikit-learn/scikit-learn/issues/4072
-        radius += 1e-6
-
-    clf = neighbors.NearestNeighbors(radius=radius)
-    A = clf.fit(mask_coords).radius_neighbors_graph(seeds)
-    A = A.tolil()
-    # Include selfs
-    mask_coords = mask_coords.astype(int).tolist()
+    affine = np.asarray(affine)
+    inv_affine = linalg.inv(affine)
+    shape = np.asarray(shape[:3])
+    # The voxel containing an integer seed is always part of its sphere,
+    # hence the minimal half-width of the search box.
+    half_width = 1. if radius is None else max(radius, 1.)
+    corners = np.asarray([[dx, dy, dz, 1.] for dx in (-1, 1)
+                          for dy in (-1, 1) for dz in (-1, 1)]).T
+    corners[:3] *= half_width
+
+    rows = []
     for i, seed in enumerate(seeds):
-        try:
-            A[i, mask_coords.index(seed)] = True
-        except ValueError:
-            # seed is not in the mask
-            pass
-    del mask_coords
-
-    if not allow_overlap:
-        if np.any(A.sum(axis=0) >= 2):
-            raise ValueError('Overlap detected between spheres')
-
-    for i, row in enumerate(A.rows):
-        if len(row) == 0:
+        # Bounding box of the search cube in voxel space
+        box = np.dot(inv_affine, corners + [[seed[0]], [seed[1]], [seed[2]],
+                                            [0]])[:3]
+        start = np.maximum(np.floor(box.min(axis=1)).astype(int), 0)
+        stop = np.minimum(np.ceil(box.max(axis=1)).astype(int) + 1, shape)
+        if np.any(stop <= start):
             raise ValueError('Sphere around seed #%i is empty' % i)
-        yield X[:, row]
+        ijk = np.mgrid[start[0]:stop[0], start[1]:stop[1],
+                       start[2]:stop[2]].reshape(3, -1)
+        if mask is not None:
+            ijk = ijk[:, mask[tuple(ijk)]]
+        coords = np.dot(affine[:3, :3], ijk).T + affine[:3, 3]
+
+        if radius is None:
+            in_sphere = np.zeros(ijk.shape[1], dtype=np.bool)
+        else:
+            in_sphere = (np.sum((coords - seed) ** 2, axis=1)
+                         <= radius ** 2)
+        # Include the first voxel whose truncated coordinates are the seed
+        is_seed = np.where(np.all(coords.astype(int) == seed, axis=1))[0]
+        if len(is_seed) > 0:
+            in_sphere[is_seed[0]] = True
+
+        if not np.any(in_sphere):
+            raise ValueError('Sphere around seed #%i is empty' % i)
+        rows.append(np.ravel_multi_index(tuple(ijk[:, in_sphere]),
+                                         tuple(shape)))
+
+    voxels, columns = np.unique(np.concatenate(rows), return_inverse=True)
+    sizes = np.asarray([len(row) for row in rows])
+    if not allow_overlap and len(columns) > len(voxels):
+        raise ValueError('Overlap detected between spheres')
+
+    spheres = sparse.csr_matrix(
+        (np.ones(len(columns)), columns,
+         np.concatenate([[0], np.cumsum(sizes)])),
+        shape=(len(seeds), len(voxels)))
+    return voxels, spheres
 
 
 class _ExtractionFunctor(object):
 
     func_name = 'nifti_spheres_masker_extractor'
 
-    def __init__(self, seeds_, radius, mask_img, allow_overlap):
-        self.seeds_ = seeds_
-        self.radius = radius
-        self.mask_img = mask_img
-        self.allow_overlap = allow_overlap
+    def __init__(self, voxels, spheres):
+        self.voxels = voxels
+        self.spheres = spheres
 
     def __call__(self, imgs):
-        n_seeds = len(self.seeds_)
         imgs = check_niimg_4d(imgs)
-
-        signals = np.empty((imgs.shape[3], n_seeds))
-        for i, sphere in enumerate(_iter_signals_from_spheres(
-                self.seeds_, imgs, self.radius, self.allow_overlap,
-                mask_img=self.mask_img)):
-            signals[:, i] = np.mean(sphere, axis=1)
-
-        return signals, None
+        data = imgs.get_data()
+        sphere_data = data[np.unravel_index(self.voxels, imgs.shape[:3])]
+        # Sum of the voxels signals, divided by the sphere sizes
+        signals = self.spheres.dot(sphere_data)
+        signals /= np.diff(self.spheres.indptr)[:, np.newaxis]
+        return signals.T, None
 
 
 class NiftiSpheresMasker(BaseMasker, CacheMixin):
@@ -166,6 +176,10 @@ class NiftiSpheresMasker(BaseMasker, CacheMixin):
         This parameter is passed to signal.clean. Please see the related
         documentation for details.
 
+    dtype: numpy dtype, optional
+        This parameter is passed to signal.clean. Please see the related
+        documentation for details.
+
     memory: joblib.Memory or str, optional
         Used to cache the region extraction process.
         By default, no caching is done. If a string is given, it is the
@@ -186,7 +200,7 @@ class NiftiSpheresMasker(BaseMasker, CacheMixin):
 
     def __init__(self, seeds, radius=None, mask_img=None, allow_overlap=False,
                  smoothing_fwhm=None, standardize=False, detrend=False,
-                 low_pass=None, high_pass=None, t_r=None,
+                 low_pass=None, high_pass=None, t_r=None, dtype=None,
                  memory=Memory(cachedir=None, verbose=0), memory_level=1,
                  verbose=0):
         self.seeds = seeds
@@ -203,6 +217,7 @@ class NiftiSpheresMasker(BaseMasker, CacheMixin):
         self.low_pass = low_pass
         self.high_pass = high_pass
         self.t_r = t_r
+        self.dtype = dtype
 
         # Parameters for joblib
         self.memory = memory
@@ -247,8 +262,38 @@ class NiftiSpheresMasker(BaseMasker, CacheMixin):
 
             self.seeds_.append(seed)
 
+        # The spheres index depends on the geometry of the images. With a
+        # mask, it is computed now, for images with the geometry of the
+        # mask. Otherwise, it is computed at the first transform.
+        self._spheres_geometry_ = None
+        if self.mask_img is not None:
+            mask_img = check_niimg_3d(self.mask_img)
+            try:
+                self._compute_spheres_index(mask_img.shape[:3],
+                                            mask_img.get_affine())
+            except ValueError:
+                # Empty or overlapping spheres with the geometry of the
+                # mask: the error is raised by transform, if the images
+                # have this geometry.
+                self._spheres_geometry_ = None
+
         return self
 
+    def _compute_spheres_index(self, shape, affine):
+        """Find the voxels of each sphere in images of the given geometry.
+        """
+        mask = None
+        if self.mask_img is not None:
+            mask_img = check_niimg_3d(self.mask_img)
+            mask_img = image.resample_img(mask_img, target_affine=affine,
+                                          target_shape=shape,
+                                          interpolation='nearest')
+            mask, _ = masking._load_mask_img(mask_img)
+        self._spheres_voxels_, self._spheres_ = \
+            _spheres_index(self.seeds_, affine, shape, self.radius,
+                           self.allow_overlap, mask=mask)
+        self._spheres_geometry_ = (shape, affine)
+
     def fit_transform(self, imgs, confounds=None):
         return self.fit().transform(imgs, confounds=confounds)
 
@@ -281,17 +326,27 @@ class NiftiSpheresMasker(BaseMasker, CacheMixin):
         """
         self._check_fitted()
 
+        # Find the voxels of each sphere only once for a given geometry.
+        imgs_ = check_niimg_4d(imgs)
+        shape = imgs_.shape[:3]
+        affine = imgs_.get_affine()
+        geometry = self._spheres_geometry_
+        if (geometry is None or geometry[0] != shape
+                or abs(geometry[1] - affine).max() > 1e-9):
+            self._compute_spheres_index(shape, affine)
+
         params = get_params(NiftiSpheresMasker, self)
 
         signals, _ = self._cache(
                 filter_and_extract,
                 ignore=['verbose', 'memory', 'memory_level'])(
             # Images
-            imgs, _ExtractionFunctor(self.seeds_, self.radius, self.mask_img,
-                                     self.allow_overlap),
+            imgs, _ExtractionFunctor(self._spheres_voxels_,
+                                     self._spheres_),
             # Pre-processing
             params,
             confounds=confounds,
+            cleaning_plan=self._get_cleaning_plan(),
             # Caching
             memory=self.memory,
             memory_level=self.memory_level,
@@ -3,6 +3,9 @@ Test the multi_nifti_masker module
 """
 # Author: Gael Varoquaux
 # License: simplified BSD
+import os
+import shutil
+import tempfile
 
 from nose.tools import assert_true, assert_false, assert_raises, assert_equal
 from nose import SkipTest
@@ -127,3 +130,28 @@ def test_joblib_cache():
         assert_true(mask_hash == hash(masker.mask_img_))
         # enables to delete "filename" on windows
         del masker
+
+
+def test_transform_imgs_memmap_dir():
+    # Masked data written to disk must be the same as in memory
+    rng = np.random.RandomState(0)
+    mask = np.zeros((6, 7, 8), dtype=np.int8)
+    mask[1:-1, 2:-2, 1:-1] = 1
+    mask_img = Nifti1Image(mask, np.eye(4))
+    imgs = [Nifti1Image(rng.randn(6, 7, 8, n), np.eye(4)) for n in (3, 4, 5)]
+    masker = MultiNiftiMasker(mask_img=mask_img, detrend=True).fit()
+    expected = masker.transform_imgs(imgs)
+
+    memmap_dir = tempfile.mkdtemp()
+    try:
+        for n_jobs in (1, 2):
+            data = masker.transform_imgs(imgs, n_jobs=n_jobs,
+                                         memmap_dir=memmap_dir)
+            assert_equal(len(data), len(imgs))
+            for d, e in zip(data, expected):
+                assert_true(isinstance(d, np.memmap))
+                np.testing.assert_array_almost_equal(d, e)
+            del data, d
+        assert_equal(len(os.listdir(memmap_dir)), 2 * len(imgs))
+    finally:
+        shutil.rmtree(memmap_dir, ignore_errors=True)
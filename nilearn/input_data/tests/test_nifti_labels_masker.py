@@ -5,12 +5,13 @@ not the underlying functions (clean(), img_to_signals_labels(), etc.). See
 test_masking.py and test_signal.py for details.
 """
 
-from nose.tools import assert_raises, assert_equal
+from nose.tools import assert_raises, assert_equal, assert_true
 import numpy as np
 
 import nibabel
 
 from nilearn.input_data.nifti_labels_masker import NiftiLabelsMasker
+from nilearn import region
 from nilearn._utils import testing, as_ndarray
 from nilearn._utils.exceptions import DimensionError
 from nilearn._utils.testing import assert_less
@@ -218,3 +219,29 @@ def test_nifti_labels_masker_resampling():
     with testing.write_tmp_imgs(fmri22_img) as filename:
         masker = NiftiLabelsMasker(labels33_img, resampling_target='data')
         masker.fit_transform(filename)
+
+
+def test_nifti_labels_masker_labels_index():
+    # The regions index computed at fit is reused across transforms and
+    # gives the same results as the region functions.
+    shape = (13, 11, 12)
+    n_regions = 9
+    length = 4
+    labels_img = testing.generate_labeled_regions(shape, n_regions=n_regions)
+    fmri1_img, mask_img = generate_random_img(shape, length=length)
+    fmri2_img, _ = generate_random_img(shape, length=length)
+
+    masker = NiftiLabelsMasker(labels_img, mask_img=mask_img)
+    masker.fit()
+    labels_index = masker._labels_index_
+    for fmri_img in (fmri1_img, fmri2_img):
+        signals = masker.transform(fmri_img)
+        assert_true(masker._labels_index_ is labels_index)
+        expected, labels = region.img_to_signals_labels(fmri_img, labels_img)
+        np.testing.assert_almost_equal(signals, expected)
+        assert_equal(masker.labels_, labels)
+
+    img = masker.inverse_transform(signals)
+    expected_img = region.signals_to_img_labels(signals, labels_img,
+                                                mask_img=mask_img)
+    np.testing.assert_array_equal(img.get_data(), expected_img.get_data())
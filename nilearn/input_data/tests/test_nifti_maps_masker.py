@@ -270,3 +270,29 @@ def test_nifti_maps_masker_overlap():
                                              allow_overlap=False)
     assert_raises_regex(ValueError, 'Overlap detected',
                         non_overlapping_masker.fit_transform, fmri_img)
+
+
+def test_nifti_maps_masker_transform_imgs():
+    # Parallel processing of several subjects, with maps large enough to be
+    # memory-mapped by joblib
+    shape = (30, 31, 32)
+    affine = np.diag((2, 2, 2, 1))
+    n_regions = 9
+    maps_img, mask_img = testing.generate_maps(shape, n_regions,
+                                               affine=affine)
+    imgs_list = [generate_random_img((15, 16, 17), length=4 + n)[0]
+                 for n in range(3)]
+    confounds = [np.random.RandomState(n).randn(4 + n, 2) for n in range(3)]
+
+    masker = NiftiMapsMasker(maps_img, mask_img=mask_img, detrend=True)
+    masker.fit()
+    signals_list = masker.transform_imgs(imgs_list, confounds=confounds,
+                                         n_jobs=2)
+    assert_equal(len(signals_list), len(imgs_list))
+    for imgs, cfs, signals in zip(imgs_list, confounds, signals_list):
+        np.testing.assert_almost_equal(
+            signals, masker.transform(imgs, confounds=cfs))
+
+    assert_raises_regex(ValueError, 'same length',
+                        masker.transform_imgs, imgs_list,
+                        confounds=confounds[:2])
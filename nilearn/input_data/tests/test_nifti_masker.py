@@ -74,6 +74,50 @@ def test_with_files():
         masker.transform(filename)
 
 
+def test_chunked_transform():
+    rng = np.random.RandomState(0)
+    data = rng.randn(9, 10, 11, 13)
+    mask = np.zeros((9, 10, 11), dtype=np.int8)
+    mask[2:-2, 2:-2, 2:-2] = 1
+    data_img = Nifti1Image(data, np.eye(4))
+    mask_img = Nifti1Image(mask, np.eye(4))
+
+    with testing.write_tmp_imgs(data_img) as filename:
+        for smoothing_fwhm in (None, 3.):
+            masker = NiftiMasker(mask_img=mask_img, detrend=True,
+                                 standardize=True,
+                                 smoothing_fwhm=smoothing_fwhm)
+            signals = masker.fit_transform(filename)
+            masker.set_params(chunk_size=4)
+            chunked_signals = masker.fit_transform(filename)
+            np.testing.assert_array_almost_equal(chunked_signals, signals)
+
+
+def test_partial_transform():
+    rng = np.random.RandomState(0)
+    data = rng.randn(9, 10, 11, 13) + 100.
+    mask = np.zeros((9, 10, 11), dtype=np.int8)
+    mask[2:-2, 2:-2, 2:-2] = 1
+    data_img = Nifti1Image(data, np.eye(4))
+    mask_img = Nifti1Image(mask, np.eye(4))
+    confounds = rng.randn(13, 2)
+
+    masker = NiftiMasker(mask_img=mask_img, detrend=True, standardize=True,
+                         dtype=np.float64).fit()
+    # Volumes arrive one at a time
+    for i in range(13):
+        signals = masker.partial_transform(index_img(data_img, i),
+                                           confounds=confounds[i:i + 1])
+        assert_true(signals.shape == (1, mask.sum()))
+    # After the last volume, the cleaning is the same as on all volumes
+    np.testing.assert_array_almost_equal(
+        signals, masker.transform(data_img, confounds=confounds)[-1:])
+
+    masker.set_params(low_pass=.1)
+    assert_raises(ValueError, masker.partial_transform,
+                  index_img(data_img, 0))
+
+
 def test_nan():
     data = np.ones((9, 9, 9))
     data[0] = np.nan
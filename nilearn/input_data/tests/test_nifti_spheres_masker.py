@@ -1,7 +1,10 @@
 import nibabel
 import numpy as np
+from scipy import linalg
 from numpy.testing import assert_array_equal
+from nose.tools import assert_true
 from nilearn.input_data import NiftiSpheresMasker
+from nilearn.input_data.nifti_spheres_masker import _spheres_index
 from nilearn._utils.testing import assert_raises_regex
 
 
@@ -92,3 +95,47 @@ def test_nifti_spheres_masker_overlap():
     noverlapping_masker = NiftiSpheresMasker(seeds, radius=2, allow_overlap=False)
     assert_raises_regex(ValueError, 'Overlap detected',
                         noverlapping_masker.fit_transform, fmri_img)
+
+
+def test_spheres_index():
+    # Compare the voxels of each sphere with a brute force search, with an
+    # oblique affine and a mask
+    rng = np.random.RandomState(0)
+    shape = (9, 10, 11)
+    affine = np.eye(4)
+    affine[:3, :3] = np.dot(linalg.qr(rng.randn(3, 3))[0],
+                            np.diag([2., 3., 2.5]))
+    affine[:3, 3] = [-10, 5, 3]
+    mask = rng.rand(*shape) > .3
+    seeds = [np.dot(affine, [4.2, 5.1, 5.3, 1])[:3].tolist(),
+             np.dot(affine, [1.5, 8.2, 2.7, 1])[:3].tolist()]
+    radius = 6.
+
+    voxels, spheres = _spheres_index(seeds, affine, shape, radius,
+                                     allow_overlap=True, mask=mask)
+    ijk = np.asarray(list(np.ndindex(shape))).T
+    coords = np.dot(affine[:3, :3], ijk).T + affine[:3, 3]
+    for seed, row in zip(seeds, spheres.toarray()):
+        expected = np.logical_and(
+            mask.ravel(),
+            np.sqrt(np.sum((coords - seed) ** 2, axis=1)) <= radius)
+        assert_array_equal(np.sort(voxels[row > 0]),
+                           np.where(expected)[0])
+
+    # The index is computed once, and reused for images of same geometry
+    data = rng.randn(*(shape + (4,)))
+    masker = NiftiSpheresMasker(seeds, radius=radius,
+                                mask_img=nibabel.Nifti1Image(
+                                    mask.astype(np.int8), affine))
+    masker.fit()
+    # The mask gives the geometry: the index is computed by fit
+    assert_array_equal(masker._spheres_voxels_, voxels)
+    assert_array_equal(masker._spheres_.toarray(), spheres.toarray())
+    spheres = masker._spheres_
+    masker.transform(nibabel.Nifti1Image(data, affine))
+    assert_true(masker._spheres_ is spheres)
+    s = masker.transform(nibabel.Nifti1Image(2 * data, affine))
+    assert_true(masker._spheres_ is spheres)
+    np.testing.assert_almost_equal(
+        s[:, 0], 2 * data[np.unravel_index(voxels[spheres.toarray()[0] > 0],
+                                           shape)].mean(axis=0))
@@ -13,7 +13,7 @@ from . import _utils
 from .image import new_img_like
 from ._utils.cache_mixin import cache
 from ._utils.ndimage import largest_connected_component, get_border_data
-from ._utils.niimg import _safe_get_data
+from ._utils.niimg import _safe_get_data, _get_volumes
 
 
 class MaskWarning(UserWarning):
@@ -63,40 +63,6 @@ def _load_mask_img(mask_img, allow_empty=False):
     return mask, mask_img.get_affine()
 
 
-def _extrapolate_out_mask(data, mask, iterations=1):
-    """ Extrapolate values outside of the mask.
-    """
-    if iterations > 1:
-        data, mask = _extrapolate_out_mask(data, mask,
-                                          iterations=iterations - 1)
-    new_mask = ndimage.binary_dilation(mask)
-    larger_mask = np.zeros(np.array(mask.shape) + 2, dtype=np.bool)
-    larger_mask[1:-1, 1:-1, 1:-1] = mask
-    # Use nans as missing value: ugly
-    masked_data = np.zeros(larger_mask.shape + data.shape[3:])
-    masked_data[1:-1, 1:-1, 1:-1] = data.copy()
-    masked_data[np.logical_not(larger_mask)] = np.nan
-    outer_shell = larger_mask.copy()
-    outer_shell[1:-1, 1:-1, 1:-1] = new_mask - mask
-    outer_shell_x, outer_shell_y, outer_shell_z = np.where(outer_shell)
-    extrapolation = list()
-    for i, j, k in [(0, 1, 0), (0, -1, 0), (1, 0, 0), (-1, 0, 0),
-                    (1, 0, 0), (-1, 0, 0)]:
-        this_x = outer_shell_x + i
-        this_y = outer_shell_y + j
-        this_z = outer_shell_z + k
-        extrapolation.append(masked_data[this_x, this_y, this_z])
-
-    extrapolation = np.array(extrapolation)
-    extrapolation = (np.nansum(extrapolation, axis=0)
-                     / np.sum(np.isfinite(extrapolation), axis=0))
-    extrapolation[np.logical_not(np.isfinite(extrapolation))] = 0
-    new_data = np.zeros_like(masked_data)
-    new_data[outer_shell] = extrapolation
-    new_data[larger_mask] = masked_data[larger_mask]
-    return new_data[1:-1, 1:-1, 1:-1], new_mask
-
-
 #
 # Utilities to compute masks
 #
@@ -516,7 +482,7 @@ def compute_multi_background_mask(data_imgs, border_size=2, upper_cutoff=0.85,
 #
 
 def apply_mask(imgs, mask_img, dtype='f',
-               smoothing_fwhm=None, ensure_finite=True):
+               smoothing_fwhm=None, ensure_finite=True, chunk_size=None):
     """Extract signals from images using specified mask.
 
     Read the time series from the given Niimg-like object, using the mask.
@@ -544,6 +510,13 @@ def apply_mask(imgs, mask_img, dtype='f',
         If ensure_finite is True (default), the non-finite values (NaNs and
         infs) found in the images will be replaced by zeros.
 
+    chunk_size: int, optional
+        If given, the 4D images are read and masked by blocks of
+        chunk_size volumes, which are written into a preallocated output
+        array. For images stored on disk, only one block is loaded in
+        memory at a time, so that peak memory usage depends on chunk_size
+        rather than on the number of scans.
+
     Returns
     --------
     session_series: numpy.ndarray
@@ -559,11 +532,13 @@ def apply_mask(imgs, mask_img, dtype='f',
     mask_img = new_img_like(mask_img, mask, mask_affine)
     return _apply_mask_fmri(imgs, mask_img, dtype=dtype,
                             smoothing_fwhm=smoothing_fwhm,
-                            ensure_finite=ensure_finite)
+                            ensure_finite=ensure_finite,
+                            chunk_size=chunk_size)
 
 
 def _apply_mask_fmri(imgs, mask_img, dtype='f',
-                     smoothing_fwhm=None, ensure_finite=True):
+                     smoothing_fwhm=None, ensure_finite=True,
+                     chunk_size=None):
     """Same as apply_mask().
 
     The only difference with apply_mask is that some costly checks on mask_img
@@ -591,10 +566,21 @@ def _apply_mask_fmri(imgs, mask_img, dtype='f',
         raise ValueError('Mask shape: %s is different from img shape:%s'
                          % (str(mask_data.shape), str(imgs_img.shape[:3])))
 
+    if chunk_size is not None and len(imgs_img.shape) == 4:
+        return _apply_mask_fmri_chunked(imgs_img, mask_data, affine,
+                                        chunk_size, dtype=dtype,
+                                        smoothing_fwhm=smoothing_fwhm,
+                                        ensure_finite=ensure_finite)
+
+    # Only the bounding box of the mask, enlarged by the extent of the
+    # smoothing filter, is needed.
+    box = _smoothing_box(mask_data, affine, smoothing_fwhm)
+    mask_data = mask_data[box]
+
     # All the following has been optimized for C order.
     # Time that may be lost in conversion here is regained multiple times
     # afterward, especially if smoothing is applied.
-    series = _safe_get_data(imgs_img)
+    series = _safe_get_data(imgs_img)[box]
 
     if dtype == 'f':
         if series.dtype.kind == 'f':
@@ -607,11 +593,69 @@ def _apply_mask_fmri(imgs, mask_img, dtype='f',
 
     # Delayed import to avoid circular imports
     from .image.image import _smooth_array
-    _smooth_array(series, affine, fwhm=smoothing_fwhm,
-                  ensure_finite=ensure_finite, copy=False)
+    # fwhm='fast' does not work in place: use the returned array
+    series = _smooth_array(series, affine, fwhm=smoothing_fwhm,
+                           ensure_finite=ensure_finite, copy=False)
     return series[mask_data].T
 
 
+def _smoothing_box(mask_data, affine, smoothing_fwhm):
+    """Slices of the bounding box of a mask, enlarged by the extent of the
+    smoothing filter.
+
+    Smoothing only the data inside this box gives the same values inside
+    the mask as smoothing the whole image.
+    """
+    # Delayed import to avoid circular imports
+    from .image.image import _smoothing_margin
+
+    if not np.any(mask_data):
+        return (slice(None), ) * 3
+    margin = _smoothing_margin(affine, smoothing_fwhm)
+    box = []
+    for axis, (m, size) in enumerate(zip(margin, mask_data.shape)):
+        other_axes = tuple(a for a in range(3) if a != axis)
+        indices = np.where(np.any(mask_data, axis=other_axes))[0]
+        box.append(slice(max(indices[0] - m, 0),
+                         min(indices[-1] + m + 1, size)))
+    return tuple(box)
+
+
+def _apply_mask_fmri_chunked(imgs_img, mask_data, affine, chunk_size,
+                             dtype='f', smoothing_fwhm=None,
+                             ensure_finite=True):
+    """Mask a 4D image by blocks of chunk_size volumes.
+
+    See _apply_mask_fmri for details. No check is performed on the inputs.
+    """
+    # Delayed import to avoid circular imports
+    from .image.image import _smooth_array
+
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer, "
+                         "got %r" % chunk_size)
+    chunk_size = int(chunk_size)
+    n_scans = imgs_img.shape[3]
+    box = _smoothing_box(mask_data, affine, smoothing_fwhm)
+    mask_data = mask_data[box]
+    series = None
+    for start in range(0, n_scans, chunk_size):
+        stop = min(start + chunk_size, n_scans)
+        block = _get_volumes(imgs_img, slice(start, stop))[box]
+        if series is None:
+            if dtype == 'f':
+                if block.dtype.kind == 'f':
+                    dtype = block.dtype
+                else:
+                    dtype = np.float32
+            series = np.empty((n_scans, mask_data.sum()), dtype=dtype)
+        block = _utils.as_ndarray(block, dtype=dtype, order="C", copy=True)
+        block = _smooth_array(block, affine, fwhm=smoothing_fwhm,
+                              ensure_finite=ensure_finite, copy=False)
+        series[start:stop] = block[mask_data].T
+    return series
+
+
 def _unmask_3d(X, mask, order="C"):
     """Take masked data and bring them back to 3D (space only).
 
@@ -8,10 +8,9 @@ or as weights in one image per region (maps).
 # License: simplified BSD
 
 import numpy as np
-from scipy import linalg, ndimage
+from scipy import linalg, sparse
 
 from . import _utils
-from . import masking
 from .image import new_img_like
 
 
@@ -87,30 +86,159 @@ def img_to_signals_labels(imgs, labels_img, mask_img=None,
             raise ValueError("mask_img and imgs affines must be identical")
 
     # Perform computation
-    labels_data = labels_img.get_data()
-    labels = list(np.unique(labels_data))
-    if background_label in labels:
-        labels.remove(background_label)
-
-    if mask_img is not None:
-        mask_data = mask_img.get_data()
-        labels_data = labels_data.copy()
-        labels_data[np.logical_not(mask_data)] = background_label
-
-    data = imgs.get_data()
-    signals = np.ndarray((data.shape[-1], len(labels)), order=order)
-    for n, img in enumerate(np.rollaxis(data, -1)):
-        signals[n] = np.asarray(ndimage.measurements.mean(img,
-                                                          labels=labels_data,
-                                                          index=labels))
-    # Set to zero signals for missing labels. Workaround for Scipy behaviour
-    missing_labels = set(labels) - set(np.unique(labels_data))
-    labels_index = dict([(l, n) for n, l in enumerate(labels)])
-    for l in missing_labels:
-        signals[:, labels_index[l]] = 0
+    labels_index = _LabelsIndex(labels_img, background_label=background_label,
+                                mask_img=mask_img)
+    signals = labels_index.img_to_signals(imgs, order=order)
+    labels = labels_index.labels
     return signals, labels
 
 
+def _labels_index(labels_data, labels):
+    """Sort the voxels of a labels array by region.
+
+    Parameters
+    ==========
+    labels_data: numpy.ndarray
+        3D array of labels.
+
+    labels: list
+        labels of the regions to index, in increasing order. Voxels with a
+        label not in this list are ignored.
+
+    Returns
+    =======
+    voxels: numpy.ndarray
+        flat (C order) indices of the voxels belonging to one of the
+        regions, sorted by region.
+
+    offsets: numpy.ndarray
+        voxels[offsets[n]:offsets[n] + sizes[n]] are the voxels of the
+        region with label labels[n].
+
+    sizes: numpy.ndarray
+        number of voxels in each region. Can be zero.
+    """
+    labels_data = labels_data.ravel()
+    voxels = np.where(np.in1d(labels_data, labels))[0]
+    # A stable sort keeps voxels in increasing order within each region
+    voxels = voxels[np.argsort(labels_data[voxels], kind='mergesort')]
+    sorted_labels = labels_data[voxels]
+    offsets = np.searchsorted(sorted_labels, labels, side='left')
+    sizes = np.searchsorted(sorted_labels, labels, side='right') - offsets
+    return voxels, offsets, sizes
+
+
+def _min_index_dtype(n):
+    """Smallest integer dtype able to hold indices up to n."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+class _LabelsIndex(object):
+    """Precomputed voxels-to-regions mapping of a labels image.
+
+    Building this index is the costly part of signal extraction from a
+    labels image. It can be computed once and reused for every image
+    sharing the labels field of view.
+
+    Parameters
+    ==========
+    labels_img: Niimg-like object
+        See http://nilearn.github.io/building_blocks/manipulating_mr_images.html#niimg.
+        regions definition as labels.
+
+    background_label: number
+        number representing background in labels_img.
+
+    mask_img: Niimg-like object, optional
+        See http://nilearn.github.io/building_blocks/manipulating_mr_images.html#niimg.
+        Every point outside the mask is considered as background. Regions
+        entirely outside the mask are kept, with zero voxels.
+
+    Attributes
+    ==========
+    labels: list
+        labels of the regions, in increasing order.
+
+    voxels: numpy.ndarray
+        flat (C order) indices of the voxels belonging to a region, sorted
+        by region.
+
+    offsets, sizes: numpy.ndarray
+        voxels[offsets[n]:offsets[n] + sizes[n]] are the voxels of the region
+        with label labels[n].
+    """
+
+    def __init__(self, labels_img, background_label=0, mask_img=None):
+        labels_img = _utils.check_niimg_3d(labels_img)
+        self.shape = labels_img.shape[:3]
+        self.affine = labels_img.get_affine()
+        self._ref_img = labels_img
+
+        if mask_img is not None:
+            mask_img = _utils.check_niimg_3d(mask_img)
+            if mask_img.shape != self.shape:
+                raise ValueError("mask_img and labels_img shapes "
+                                 "must be identical.")
+            if abs(mask_img.get_affine() - self.affine).max() > 1e-9:
+                raise ValueError("mask_img and labels_img affines "
+                                 "must be identical")
+
+        labels_data = labels_img.get_data()
+        labels = list(np.unique(labels_data))
+        if background_label in labels:
+            labels.remove(background_label)
+
+        if mask_img is not None:
+            labels_data = labels_data.copy()
+            labels_data[np.logical_not(mask_img.get_data())] = \
+                background_label
+
+        voxels, offsets, sizes = _labels_index(labels_data, labels)
+        self.labels = labels
+        self.voxels = voxels.astype(_min_index_dtype(labels_data.size))
+        self.offsets = offsets.astype(_min_index_dtype(voxels.size))
+        self.sizes = sizes.astype(_min_index_dtype(voxels.size))
+
+    def _check_fov(self, img):
+        if img.shape[:3] != self.shape:
+            raise ValueError("labels_img and imgs shapes must be identical.")
+        if abs(img.get_affine() - self.affine).max() > 1e-9:
+            raise ValueError("labels_img and imgs affines must be identical")
+
+    def img_to_signals(self, imgs, order="F"):
+        """Average imgs in each region. See img_to_signals_labels."""
+        imgs = _utils.check_niimg_4d(imgs)
+        self._check_fov(imgs)
+
+        data = imgs.get_data()
+        signals = np.zeros((data.shape[-1], len(self.labels)), order=order)
+        # Regions entirely outside of the mask keep a zero signal
+        non_empty = self.sizes > 0
+        if np.any(non_empty):
+            # All in-region voxels are gathered once, sorted by region, so
+            # that each region is a contiguous block reduced in one pass.
+            region_data = data[np.unravel_index(self.voxels, self.shape)]
+            sums = np.add.reduceat(region_data, self.offsets[non_empty],
+                                   axis=0, dtype=np.float64)
+            del region_data
+            sums /= self.sizes[non_empty][:, np.newaxis]
+            signals[:, non_empty] = sums.T
+        return signals
+
+    def signals_to_img(self, signals, order="F"):
+        """Broadcast region signals to voxels. See signals_to_img_labels."""
+        signals = np.asarray(signals)
+        data = np.zeros(self.shape + (signals.shape[0],),
+                        dtype=signals.dtype, order=order)
+        # Region number of each indexed voxel
+        regions = np.repeat(np.arange(len(self.labels)), self.sizes)
+        data[np.unravel_index(self.voxels, self.shape)] = signals.T[regions]
+        return new_img_like(self._ref_img, data, self.affine)
+
+
 def signals_to_img_labels(signals, labels_img, mask_img=None,
                     background_label=0, order="F"):
     """Create image from region signals defined as labels.
@@ -151,48 +279,143 @@ def signals_to_img_labels(signals, labels_img, mask_img=None,
     nilearn.region.signals_to_img_maps
     """
 
-    labels_img = _utils.check_niimg_3d(labels_img)
+    labels_index = _LabelsIndex(labels_img, background_label=background_label,
+                                mask_img=mask_img)
+    return labels_index.signals_to_img(signals, order=order)
 
-    signals = np.asarray(signals)
-    target_affine = labels_img.get_affine()
-    target_shape = labels_img.shape[:3]
 
-    if mask_img is not None:
-        mask_img = _utils.check_niimg_3d(mask_img)
-        if mask_img.shape != target_shape:
-            raise ValueError("mask_img and labels_img shapes "
-                             "must be identical.")
-        if abs(mask_img.get_affine() - target_affine).max() > 1e-9:
-            raise ValueError("mask_img and labels_img affines "
-                             "must be identical")
+class _SparseMaps(object):
+    """Sparse representation of a set of maps, for signal extraction.
 
-    labels_data = labels_img.get_data()
-    labels = list(np.unique(labels_data))
-    if background_label in labels:
-        labels.remove(background_label)
+    The maps are restricted to the voxels where at least one of them is
+    non-zero and stored as a sparse (voxels, maps) matrix. The factorization
+    of their Gram matrix is computed once, so that extracting signals from
+    an image only requires a sparse product and a small triangular solve.
 
-    if mask_img is not None:
-        mask_data = mask_img.get_data()
-        labels_data = labels_data.copy()
-        labels_data[np.logical_not(mask_data)] = background_label
-
-    # nditer is not available in numpy 1.3: using multiple loops.
-    # Using these loops still gives a much faster code (6x) than this one:
-    ## for n, label in enumerate(labels):
-    ##     data[labels_data == label, :] = signals[:, n]
-    data = np.zeros(target_shape + (signals.shape[0],),
-                    dtype=signals.dtype, order=order)
-    labels_dict = dict([(label, n) for n, label in enumerate(labels)])
-    # optimized for "data" in F order.
-    for k in range(labels_data.shape[2]):
-        for j in range(labels_data.shape[1]):
-            for i in range(labels_data.shape[0]):
-                label = labels_data[i, j, k]
-                num = labels_dict.get(label, None)
-                if num is not None:
-                    data[i, j, k, :] = signals[:, num]
-
-    return new_img_like(labels_img, data, target_affine)
+    Parameters
+    ==========
+    maps_img: Niimg-like object
+        See http://nilearn.github.io/building_blocks/manipulating_mr_images.html#niimg.
+        regions definition as maps (array of weights).
+
+    mask_img: Niimg-like object, optional
+        See http://nilearn.github.io/building_blocks/manipulating_mr_images.html#niimg.
+        mask to apply to regions, as in img_to_signals_maps. Maps entirely
+        outside the mask are kept, with zero weights.
+
+    Attributes
+    ==========
+    labels: list
+        maps_img[..., labels[n]] is the map of the n-th region.
+
+    voxels: numpy.ndarray
+        flat (C order) indices of the voxels in the support of the maps.
+
+    maps: scipy.sparse.csc_matrix
+        weights of the maps on these voxels. shape: (voxels, maps)
+    """
+
+    def __init__(self, maps_img, mask_img=None):
+        maps_img = _utils.check_niimg_4d(maps_img)
+        self.shape = maps_img.shape[:3]
+        self.affine = maps_img.get_affine()
+        self.maps_img = maps_img
+        self.mask_img = mask_img
+
+        if mask_img is not None:
+            mask_img = _utils.check_niimg_3d(mask_img)
+            if mask_img.shape != self.shape:
+                raise ValueError("mask_img and maps_img shapes must be "
+                                 "identical.")
+            if abs(mask_img.get_affine() - self.affine).max() > 1e-9:
+                raise ValueError("mask_img and maps_img affines must be "
+                                 "identical.")
+            mask = _utils.as_ndarray(mask_img.get_data(), dtype=np.bool)
+
+        maps_data = maps_img.get_data()
+        n_maps = maps_data.shape[-1]
+        self._dtype = maps_data.dtype
+        self.labels = list(range(n_maps))
+
+        # Support of the maps. As in _trim_maps, only positive weights
+        # define it when a mask is given.
+        support = np.zeros(self.shape, dtype=np.bool)
+        for n in range(n_maps):
+            if mask_img is None:
+                support |= maps_data[..., n] != 0
+            else:
+                support |= maps_data[..., n] > 0
+        if mask_img is not None:
+            support &= mask
+        voxels = np.where(support.ravel())[0]
+        del support
+
+        # Build the CSC matrix one map at a time, to never hold a dense
+        # (voxels, maps) array.
+        indices = []
+        values = []
+        indptr = np.zeros(n_maps + 1, dtype=np.int64)
+        for n in range(n_maps):
+            weights = maps_data[..., n].ravel()[voxels]
+            non_zero = np.where(weights != 0)[0]
+            indices.append(non_zero)
+            values.append(weights[non_zero].astype(np.float64))
+            indptr[n + 1] = indptr[n] + non_zero.size
+        self.voxels = voxels.astype(_min_index_dtype(maps_data[..., 0].size))
+        self.maps = sparse.csc_matrix(
+            (np.concatenate(values) if values else np.zeros(0),
+             np.concatenate(indices) if indices else np.zeros(0, np.int64),
+             indptr),
+            shape=(voxels.size, n_maps))
+
+        # Factorize the Gram matrix once for all.
+        gram = self.maps.T.dot(self.maps).toarray()
+        self._gram_cho = None
+        self._gram_pinv = None
+        try:
+            self._gram_cho = linalg.cho_factor(gram)
+            # Badly conditioned Gram matrices (e.g. duplicated maps) are
+            # handled as singular ones.
+            diag = np.diag(self._gram_cho[0])
+            if (diag.min() / diag.max()) ** 2 < \
+                    n_maps * np.finfo(np.float64).eps:
+                raise linalg.LinAlgError
+        except (linalg.LinAlgError, ValueError):
+            # Empty or linearly dependent maps: use the minimum norm
+            # solution, as a least-squares solver would.
+            self._gram_cho = None
+            self._gram_pinv = linalg.pinvh(gram)
+
+    def _check_fov(self, img):
+        if img.shape[:3] != self.shape:
+            raise ValueError("maps_img and imgs shapes must be identical.")
+        if abs(img.get_affine() - self.affine).max() > 1e-9:
+            raise ValueError("maps_img and imgs affines must be identical")
+
+    def img_to_signals(self, imgs):
+        """Least-squares fit of the maps on imgs. See img_to_signals_maps."""
+        imgs = _utils.check_niimg_4d(imgs)
+        self._check_fov(imgs)
+
+        data = imgs.get_data()
+        region_data = data[np.unravel_index(self.voxels, self.shape)]
+        # maps.T * data: the right-hand side of the normal equations
+        projections = self.maps.T.dot(region_data)
+        del region_data
+        if self._gram_cho is not None:
+            region_signals = linalg.cho_solve(self._gram_cho, projections)
+        else:
+            region_signals = np.dot(self._gram_pinv, projections)
+        return region_signals.T
+
+    def signals_to_img(self, region_signals):
+        """Linear combination of the maps. See signals_to_img_maps."""
+        region_signals = np.asarray(region_signals)
+        dtype = np.result_type(region_signals.dtype, self._dtype)
+        data = np.zeros(self.shape + (region_signals.shape[0],), dtype=dtype)
+        data[np.unravel_index(self.voxels, self.shape)] = \
+            self.maps.dot(region_signals.T)
+        return new_img_like(self.maps_img, data, self.affine)
 
 
 def img_to_signals_maps(imgs, maps_img, mask_img=None):
@@ -247,24 +470,16 @@ def img_to_signals_maps(imgs, maps_img, mask_img=None):
     if abs(maps_img.get_affine() - affine).max() > 1e-9:
         raise ValueError("maps_img and imgs affines must be identical")
 
-    maps_data = maps_img.get_data()
-
     if mask_img is not None:
         mask_img = _utils.check_niimg_3d(mask_img)
         if mask_img.shape != shape:
             raise ValueError("mask_img and imgs shapes must be identical.")
         if abs(mask_img.get_affine() - affine).max() > 1e-9:
             raise ValueError("mask_img and imgs affines must be identical")
-        maps_data, maps_mask, labels = \
-                   _trim_maps(maps_data, mask_img.get_data(), keep_empty=True)
-        maps_mask = _utils.as_ndarray(maps_mask, dtype=np.bool)
-    else:
-        maps_mask = np.ones(maps_data.shape[:3], dtype=np.bool)
-        labels = np.arange(maps_data.shape[-1], dtype=np.int)
 
-    data = imgs.get_data()
-    region_signals = linalg.lstsq(maps_data[maps_mask, :],
-                                  data[maps_mask, :])[0].T
+    sparse_maps = _SparseMaps(maps_img, mask_img=mask_img)
+    region_signals = sparse_maps.img_to_signals(imgs)
+    labels = sparse_maps.labels
 
     return region_signals, list(labels)
 
@@ -301,28 +516,8 @@ def signals_to_img_maps(region_signals, maps_img, mask_img=None):
     nilearn.region.img_to_signals_maps
     """
 
-    maps_img = _utils.check_niimg_4d(maps_img)
-    maps_data = maps_img.get_data()
-    shape = maps_img.shape[:3]
-    affine = maps_img.get_affine()
-
-    if mask_img is not None:
-        mask_img = _utils.check_niimg_3d(mask_img)
-        if mask_img.shape != shape:
-            raise ValueError("mask_img and maps_img shapes must be identical.")
-        if abs(mask_img.get_affine() - affine).max() > 1e-9:
-            raise ValueError("mask_img and maps_img affines must be "
-                             "identical.")
-        maps_data, maps_mask, _ = _trim_maps(maps_data, mask_img.get_data(),
-                                             keep_empty=True)
-        maps_mask = _utils.as_ndarray(maps_mask, dtype=np.bool)
-    else:
-        maps_mask = np.ones(maps_data.shape[:3], dtype=np.bool)
-
-    assert(maps_mask.shape == maps_data.shape[:3])
-
-    data = np.dot(region_signals, maps_data[maps_mask, :].T)
-    return masking.unmask(data, new_img_like(maps_img, maps_mask, affine))
+    sparse_maps = _SparseMaps(maps_img, mask_img=mask_img)
+    return sparse_maps.signals_to_img(region_signals)
 
 
 def _trim_maps(maps, mask, keep_empty=False, order="F"):
@@ -7,19 +7,33 @@ features
 # Authors: Alexandre Abraham, Gael Varoquaux, Philippe Gervais
 # License: simplified BSD
 
-import distutils.version
+import collections
+import csv
+import io
+import os
 import warnings
 
 import numpy as np
 import scipy
 from scipy import signal, stats, linalg
-from sklearn.utils import gen_even_slices
+from sklearn.utils import check_random_state
 from distutils.version import LooseVersion
 
-from ._utils.compat import _basestring
+import nilearn
+from ._utils.compat import _basestring, izip
 from ._utils.numpy_conversions import csv_to_array
 
-NP_VERSION = distutils.version.LooseVersion(np.version.short_version).version
+
+def _column_batches(n_samples, n_features, itemsize=8):
+    """Slices of blocks of columns of a (n_samples, n_features) array.
+
+    A block of columns with items of itemsize bytes takes at most
+    nilearn.MAX_TEMPORARY_BYTES bytes (and at least one column).
+    """
+    n_columns = max(1, int(nilearn.MAX_TEMPORARY_BYTES //
+                           max(1, n_samples * itemsize)))
+    for start in range(0, n_features, n_columns):
+        yield slice(start, min(start + n_columns, n_features))
 
 
 def _standardize(signals, detrend=False, normalize=True):
@@ -53,17 +67,20 @@ def _standardize(signals, detrend=False, normalize=True):
         return signals
 
     if normalize:
-        if not detrend:
-            # remove mean if not already detrended
-            signals = signals - signals.mean(axis=0)
-
-        std = np.sqrt((signals ** 2).sum(axis=0))
-        std[std < np.finfo(np.float).eps] = 1.  # avoid numerical problems
-        signals /= std
+        for batch in _column_batches(signals.shape[0], signals.shape[1],
+                                     signals.dtype.itemsize):
+            block = signals[:, batch]
+            if not detrend:
+                # remove mean if not already detrended
+                block -= block.mean(axis=0)
+
+            std = np.sqrt((block ** 2).sum(axis=0))
+            std[std < np.finfo(np.float).eps] = 1.  # avoid numerical problems
+            block /= std
     return signals
 
 
-def _mean_of_squares(signals, n_batches=20):
+def _mean_of_squares(signals):
     """Compute mean of squares for each signal.
     This function is equivalent to
 
@@ -78,19 +95,15 @@ def _mean_of_squares(signals, n_batches=20):
     signals : numpy.ndarray, shape (n_samples, n_features)
         signal whose mean of squares must be computed.
 
-    n_batches : int, optional
-        number of batches to use in the computation. Tweaking this value
-        can lead to variation of memory usage and computation time. The higher
-        the value, the lower the memory consumption.
-
+    Notes
+    =====
+    Signals are processed by blocks of columns: temporary arrays take at
+    most nilearn.MAX_TEMPORARY_BYTES bytes.
     """
-    # No batching for small arrays
-    if signals.shape[1] < 500:
-        n_batches = 1
-
     # Fastest for C order
     var = np.empty(signals.shape[1])
-    for batch in gen_even_slices(signals.shape[1], n_batches):
+    for batch in _column_batches(signals.shape[0], signals.shape[1],
+                                 signals.dtype.itemsize):
         tvar = np.copy(signals[:, batch])
         tvar **= 2
         var[batch] = tvar.mean(axis=0)
@@ -98,7 +111,7 @@ def _mean_of_squares(signals, n_batches=20):
     return var
 
 
-def _detrend(signals, inplace=False, type="linear", n_batches=10):
+def _detrend(signals, inplace=False, type="linear"):
     """Detrend columns of input array.
 
     Signals are supposed to be columns of `signals`.
@@ -119,11 +132,6 @@ def _detrend(signals, inplace=False, type="linear", n_batches=10):
         Detrending type ("linear" or "constant").
         See also scipy.signal.detrend.
 
-    n_batches : int, optional
-        number of batches to use in the computation. Tweaking this value
-        can lead to variation of memory usage and computation time. The higher
-        the value, the lower the memory consumption.
-
     Returns
     =======
     detrended_signals: numpy.ndarray
@@ -134,6 +142,9 @@ def _detrend(signals, inplace=False, type="linear", n_batches=10):
 
     If a signal of lenght 1 is given, it is returned unchanged.
 
+    Signals are processed by blocks of columns: temporary arrays take at
+    most nilearn.MAX_TEMPORARY_BYTES bytes.
+
     """
     if not inplace:
         signals = signals.copy()
@@ -154,17 +165,28 @@ def _detrend(signals, inplace=False, type="linear", n_batches=10):
             regressor /= std
         regressor = regressor[:, np.newaxis]
 
-        # No batching for small arrays
-        if signals.shape[1] < 500:
-            n_batches = 1
-
         # This is fastest for C order.
-        for batch in gen_even_slices(signals.shape[1], n_batches):
+        for batch in _column_batches(signals.shape[0], signals.shape[1],
+                                     signals.dtype.itemsize):
             signals[:, batch] -= np.dot(regressor[:, 0], signals[:, batch]
                                         ) * regressor
     return signals
 
 
+def _trends(n_samples):
+    """Orthonormal basis of the constant and linear trends.
+
+    Projecting a signal on the orthogonal of this basis is the same as
+    detrending it with _detrend.
+    """
+    trends = np.empty((n_samples, 2))
+    trends[:, 0] = 1. / np.sqrt(n_samples)
+    regressor = np.arange(n_samples, dtype=np.float)
+    regressor -= regressor.mean()
+    trends[:, 1] = regressor / np.sqrt((regressor ** 2).sum())
+    return trends
+
+
 def _check_wn(btype, freq, nyq):
     wn = freq / float(nyq)
     if wn > 1.:
@@ -176,8 +198,61 @@ def _check_wn(btype, freq, nyq):
     return wn
 
 
+def _butterworth_coefficients(sampling_rate, low_pass=None, high_pass=None,
+                              order=5, output='ba'):
+    """Coefficients of a Butterworth filter. See butterworth.
+
+    output is passed to scipy.signal.butter: 'ba' for the (b, a)
+    coefficients, 'zpk' for zeros, poles and gain, 'sos' for second-order
+    sections.
+    """
+    if low_pass is not None and high_pass is not None \
+            and high_pass >= low_pass:
+        raise ValueError(
+            "High pass cutoff frequency (%f) is greater or equal"
+            "to low pass filter frequency (%f). This case is not handled "
+            "by this function."
+            % (high_pass, low_pass))
+
+    nyq = sampling_rate * 0.5
+
+    critical_freq = []
+    if high_pass is not None:
+        btype = 'high'
+        critical_freq.append(_check_wn(btype, high_pass, nyq))
+
+    if low_pass is not None:
+        btype = 'low'
+        critical_freq.append(_check_wn(btype, low_pass, nyq))
+
+    if len(critical_freq) == 2:
+        btype = 'band'
+    else:
+        critical_freq = critical_freq[0]
+
+    return signal.butter(order, critical_freq, btype=btype, output=output)
+
+
+def _zero_phase_gain(zpk, n_samples):
+    """Gain of a filter applied forward and backward, at the frequencies of
+    the real FFT of a signal of length n_samples.
+    """
+    z, p, k = zpk
+    # Points of the unit circle, at the frequencies of np.fft.rfft
+    w = np.exp(2j * np.pi * np.arange(n_samples // 2 + 1)
+               / float(n_samples))
+    # The gain is computed from the zeros and poles: this is more accurate
+    # than from (b, a) for narrow bands.
+    gain = np.abs(k) * np.ones(w.shape)
+    for zero in z:
+        gain *= np.abs(w - zero)
+    for pole in p:
+        gain /= np.abs(w - pole)
+    return gain ** 2
+
+
 def butterworth(signals, sampling_rate, low_pass=None, high_pass=None,
-                order=5, copy=False, save_memory=False):
+                order=5, copy=False, save_memory=False, method='ba'):
     """ Apply a low-pass, high-pass or band-pass Butterworth filter
 
     Apply a filter to remove signal below the `low` frequency and above the
@@ -210,42 +285,67 @@ def butterworth(signals, sampling_rate, low_pass=None, high_pass=None,
         If False, `signals` is modified inplace, and memory consumption is
         lower than for copy=True, though computation time is higher.
 
+    method: {'ba', 'sos', 'fft'}, optional
+        How the filter is applied. All methods are zero-phase: the filter
+        is applied forward and backward.
+        'ba' uses the (b, a) coefficients of the filter with
+        scipy.signal.filtfilt. 'sos' uses second-order sections with
+        scipy.signal.sosfiltfilt (scipy >= 0.18): it is numerically stable
+        for narrow bands, e.g. band-pass filters at low sampling rates.
+        'fft' multiplies the Fourier transform of the signals by the
+        squared gain of the filter: all signals are filtered at once, but
+        the signals are then considered periodic, which changes their
+        edges. With 'sos' and 'fft', signals are processed by blocks and
+        written in place.
+
     Returns
     -------
     filtered_signals: numpy.ndarray
         Signals filtered according to the parameters
     """
+    if method not in ('ba', 'sos', 'fft'):
+        raise ValueError("method must be 'ba', 'sos' or 'fft', got %r"
+                         % (method, ))
+    if method == 'sos' and not hasattr(signal, 'sosfiltfilt'):
+        raise ValueError("method='sos' requires scipy >= 0.18, got %s"
+                         % scipy.__version__)
+
     if low_pass is None and high_pass is None:
         if copy:
-            return signal.copy()
+            return signals.copy()
         else:
-            return signal
+            return signals
 
-    if low_pass is not None and high_pass is not None \
-            and high_pass >= low_pass:
-        raise ValueError(
-            "High pass cutoff frequency (%f) is greater or equal"
-            "to low pass filter frequency (%f). This case is not handled "
-            "by this function."
-            % (high_pass, low_pass))
-
-    nyq = sampling_rate * 0.5
-
-    critical_freq = []
-    if high_pass is not None:
-        btype = 'high'
-        critical_freq.append(_check_wn(btype, high_pass, nyq))
-
-    if low_pass is not None:
-        btype = 'low'
-        critical_freq.append(_check_wn(btype, low_pass, nyq))
-
-    if len(critical_freq) == 2:
-        btype = 'band'
-    else:
-        critical_freq = critical_freq[0]
+    if method != 'ba':
+        if copy:
+            signals = signals.copy()
+        # A 2D view, to process 1D and 2D signals alike
+        signals_2d = signals.reshape((signals.shape[0], -1))
+        n_samples = signals_2d.shape[0]
+        if method == 'sos':
+            sos = _butterworth_coefficients(
+                sampling_rate, low_pass=low_pass, high_pass=high_pass,
+                order=order, output='sos')
+        else:
+            gain = _zero_phase_gain(
+                _butterworth_coefficients(
+                    sampling_rate, low_pass=low_pass, high_pass=high_pass,
+                    order=order, output='zpk'), n_samples)[:, np.newaxis]
+        # Blocks of signals limit the size of temporary arrays (the complex
+        # spectrum takes twice the size of real signals)
+        for batch in _column_batches(n_samples, signals_2d.shape[1],
+                                     2 * signals_2d.dtype.itemsize):
+            block = signals_2d[:, batch]
+            if method == 'sos':
+                block[...] = signal.sosfiltfilt(sos, block, axis=0)
+            else:
+                spectrum = np.fft.rfft(block, axis=0)
+                spectrum *= gain
+                block[...] = np.fft.irfft(spectrum, n=n_samples, axis=0)
+        return signals
 
-    b, a = signal.butter(order, critical_freq, btype=btype)
+    b, a = _butterworth_coefficients(sampling_rate, low_pass=low_pass,
+                                     high_pass=high_pass, order=order)
     if signals.ndim == 1:
         # 1D case
         output = signal.filtfilt(b, a, signals)
@@ -271,8 +371,97 @@ def butterworth(signals, sampling_rate, low_pass=None, high_pass=None,
     return signals
 
 
+def _upper_percentile_threshold(values, percentile):
+    """Same as stats.scoreatpercentile(values, 100. - percentile), with a
+    partial sort of values instead of a full sort."""
+    if not hasattr(np, 'partition'):
+        # np.partition was added in numpy 1.8
+        return stats.scoreatpercentile(values, 100. - percentile)
+    index = (100. - percentile) / 100. * (values.size - 1)
+    lower = int(np.floor(index))
+    upper = min(lower + 1, values.size - 1)
+    lower_value, upper_value = np.partition(values, [lower, upper])[
+        [lower, upper]]
+    return lower_value + (upper_value - lower_value) * (index - lower)
+
+
+def _high_variance_confounds(blocks, n_confounds=5, percentile=2.,
+                             detrend=True, svd_solver='full',
+                             random_state=None):
+    """Compute high variance confounds from blocks of series.
+
+    blocks is a callable returning an iterator over blocks of columns of
+    the series, always in the same order. Each pass over the series calls
+    it once: only one block at a time is in memory.
+    """
+    if svd_solver not in ('full', 'randomized'):
+        raise ValueError("svd_solver must be 'full' or 'randomized', "
+                         "got %r" % (svd_solver, ))
+
+    def _float_block(block, columns=None):
+        if columns is not None:
+            block = block[:, columns]
+        block = np.array(block, dtype=np.float, copy=True)
+        if detrend:
+            block = _detrend(block, inplace=True)
+        return block
+
+    # First pass: variance (without mean removal) of each series
+    var = np.concatenate([_mean_of_squares(_float_block(block))
+                          for block in blocks()])
+    # Retrieve the voxels|features with highest variance
+    selected = var > _upper_percentile_threshold(var, percentile)
+
+    def selected_blocks():
+        start = 0
+        for block in blocks():
+            stop = start + block.shape[1]
+            columns = selected[start:stop]
+            start = stop
+            if np.any(columns):
+                yield _float_block(block, columns)
+
+    if svd_solver == 'full':
+        # Return the singular vectors with largest singular values
+        # We solve the symmetric eigenvalue problem here, increasing
+        # stability. The Gram matrix is accumulated block by block.
+        gram = 0.
+        for block in selected_blocks():
+            gram = gram + np.dot(block, block.T)
+        s, u = linalg.eigh(gram)
+        ix_ = np.argsort(s)[::-1]
+        return u[:, ix_[:n_confounds]].copy()
+
+    # Randomized range finder (Halko et al. 2011), one pass over the
+    # selected series for each product by the series.
+    random_state = check_random_state(random_state)
+    n_components = n_confounds + 10  # oversampling
+    omega = random_state.normal(size=(selected.sum(), n_components))
+    Q = 0.
+    start = 0
+    for block in selected_blocks():
+        Q = Q + np.dot(block, omega[start:start + block.shape[1]])
+        start += block.shape[1]
+    Q = linalg.qr(Q, mode='economic')[0]
+    for _ in range(2):
+        # Power iterations: Q spans series.dot(series.T).dot(Q)
+        product = 0.
+        for block in selected_blocks():
+            product = product + np.dot(block, np.dot(block.T, Q))
+        Q = linalg.qr(product, mode='economic')[0]
+    # Singular vectors of the series projected on the range of Q
+    gram = 0.
+    for block in selected_blocks():
+        projected = np.dot(Q.T, block)
+        gram = gram + np.dot(projected, projected.T)
+    s, u = linalg.eigh(gram)
+    ix_ = np.argsort(s)[::-1]
+    return np.dot(Q, u[:, ix_[:n_confounds]])
+
+
 def high_variance_confounds(series, n_confounds=5, percentile=2.,
-                            detrend=True):
+                            detrend=True, svd_solver='full',
+                            random_state=None):
     """ Return confounds time series extracted from series with highest
         variance.
 
@@ -293,6 +482,16 @@ def high_variance_confounds(series, n_confounds=5, percentile=2.,
         detrend: bool, optional
             If True, detrend timeseries before processing.
 
+        svd_solver: {'full', 'randomized'}, optional
+            'full' computes the exact decomposition from the matrix of
+            products of the samples, of size samples x samples. 'randomized'
+            computes an approximate decomposition, with a few more passes
+            over the series, and is faster for long series.
+
+        random_state: int or RandomState, optional
+            Pseudo-random number generator state used for the randomized
+            decomposition.
+
         Returns
         =======
         v: numpy.ndarray
@@ -311,41 +510,552 @@ def high_variance_confounds(series, n_confounds=5, percentile=2.,
         - return a given number (n_confounds) of series from the svd with
           highest singular values.
 
+        Series are processed by blocks: neither a detrended copy of the
+        series nor the extracted series are stored in memory.
+
         See also
         ========
         nilearn.image.high_variance_confounds
     """
+    def blocks():
+        # Blocks are converted to double precision
+        for batch in _column_batches(series.shape[0], series.shape[1]):
+            yield series[:, batch]
 
-    if detrend:
-        series = _detrend(series)  # copy
-
-    # Retrieve the voxels|features with highest variance
-
-    # Compute variance without mean removal.
-    var = _mean_of_squares(series)
-
-    var_thr = stats.scoreatpercentile(var, 100. - percentile)
-    series = series[:, var > var_thr]  # extract columns (i.e. features)
-    # Return the singular vectors with largest singular values
-    # We solve the symmetric eigenvalue problem here, increasing stability
-    s, u = linalg.eigh(series.dot(series.T) / series.shape[0])
-    ix_ = np.argsort(s)[::-1]
-    u = u[:, ix_[:n_confounds]].copy()
-    return u
+    return _high_variance_confounds(blocks, n_confounds=n_confounds,
+                                    percentile=percentile, detrend=detrend,
+                                    svd_solver=svd_solver,
+                                    random_state=random_state)
 
 
 def _ensure_float(data):
     "Make sure that data is a float type"
     if not data.dtype.kind == 'f':
-        if data.dtype.itemsize == '8':
+        if data.dtype.itemsize == 8:
             data = data.astype(np.float64)
         else:
             data = data.astype(np.float32)
     return data
 
 
+def _session_segments(sessions, n_samples):
+    """Samples of each session: slices for contiguous sessions, arrays of
+    indices otherwise."""
+    sessions = np.asarray(sessions)
+    if not len(sessions) == n_samples:
+        raise ValueError(('The length of the session vector (%i) '
+                          'does not match the length of the signals (%i)')
+                         % (len(sessions), n_samples))
+    segments = []
+    for session in np.unique(sessions):
+        indices = np.where(sessions == session)[0]
+        if indices[-1] - indices[0] + 1 == len(indices):
+            segments.append(slice(indices[0], indices[-1] + 1))
+        else:
+            segments.append(indices)
+    return segments
+
+
+def _interpolate_censored(signals, kept):
+    """Copy of signals, where samples not in kept are replaced by a linear
+    interpolation of the previous and next kept samples.
+
+    kept must be sorted. Censored samples before the first (after the last)
+    kept sample take its value.
+    """
+    signals = np.array(_ensure_float(signals), copy=True)
+    censored = np.setdiff1d(np.arange(signals.shape[0]), kept)
+    if len(censored) == 0:
+        return signals
+    next_kept = np.searchsorted(kept, censored)
+    before = kept[np.maximum(next_kept - 1, 0)]
+    after = kept[np.minimum(next_kept, len(kept) - 1)]
+    weights = np.zeros(len(censored))
+    interval = after != before
+    weights[interval] = ((censored - before)[interval]
+                         / (after - before)[interval].astype(np.float))
+    if signals.ndim > 1:
+        weights = weights[:, np.newaxis]
+    signals[censored] = ((1. - weights) * signals[before]
+                         + weights * signals[after])
+    return signals
+
+
+def _is_number(string):
+    try:
+        float(string)
+    except ValueError:
+        return False
+    return True
+
+
+def _parse_confounds_file(filename):
+    """Read a CSV file of confounds, with an optional one-line header.
+
+    The delimiter and the header are detected on the text of the file, which
+    is then parsed once.
+    """
+    with open(filename, 'rb') as csv_file:
+        data = csv_file.read()
+    lines = [line for line in data.decode('latin-1').splitlines()
+             if line.strip()]
+    if len(lines) == 0:
+        return csv_to_array(filename)
+
+    # The delimiter is detected on the last line, which is not a header
+    delimiter = None  # Any whitespace
+    if not all(_is_number(field) for field in lines[-1].split()):
+        try:
+            delimiter = csv.Sniffer().sniff(lines[-1], ' \t,;').delimiter
+        except csv.Error as e:
+            raise TypeError(
+                'Could not read CSV file [%s]: %s' % (filename, e.args[0]))
+    header = not _is_number(lines[0].split(delimiter)[0])
+    if header:
+        data = data[data.index(lines[0].encode('latin-1')) +
+                    len(lines[0]):]
+    return np.genfromtxt(io.BytesIO(data), delimiter=delimiter)
+
+
+# Confounds read from files, least recently used first
+_confounds_files = collections.OrderedDict()
+_CONFOUNDS_FILES_CACHE_SIZE = 128
+
+
+def _read_confounds_file(filename):
+    """Read a CSV file of confounds, or get it from the cache of files
+    already read.
+
+    Files are identified by their path, modification time and size. The
+    returned array is read-only. If nilearn.CONFOUNDS_NPY_SIDECAR is True,
+    the confounds are also saved in a .npy file next to the CSV file, which
+    is loaded instead of parsing the CSV file next time.
+    """
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+    if key in _confounds_files:
+        # Most recently used
+        confounds = _confounds_files.pop(key)
+        _confounds_files[key] = confounds
+        return confounds
+
+    sidecar = filename + '.npy'
+    if (nilearn.CONFOUNDS_NPY_SIDECAR and os.path.exists(sidecar)
+            and os.stat(sidecar).st_mtime >= stat.st_mtime):
+        confounds = np.load(sidecar)
+    else:
+        confounds = _parse_confounds_file(filename)
+        if nilearn.CONFOUNDS_NPY_SIDECAR:
+            try:
+                np.save(sidecar, confounds)
+            except (IOError, OSError):
+                # e.g. read-only directory: the CSV file will be parsed
+                # again in other processes.
+                pass
+    confounds.setflags(write=False)
+    _confounds_files[key] = confounds
+    if len(_confounds_files) > _CONFOUNDS_FILES_CACHE_SIZE:
+        _confounds_files.popitem(last=False)
+    return confounds
+
+
+def _load_confounds(confounds):
+    """Read and check confounds, given as in clean.
+
+    Returns None or a 2D array, with one confound per column.
+    """
+    if not isinstance(confounds,
+                      (list, tuple, _basestring, np.ndarray, type(None))):
+        raise TypeError("confounds keyword has an unhandled type: %s"
+                        % confounds.__class__)
+
+    if confounds is None:
+        return None
+
+    if not isinstance(confounds, (list, tuple)):
+        confounds = (confounds, )
+
+    all_confounds = []
+    for confound in confounds:
+        if isinstance(confound, _basestring):
+            confound = _read_confounds_file(confound)
+            if confound.ndim == 1:
+                confound = np.atleast_2d(confound).T
+
+        elif isinstance(confound, np.ndarray):
+            if confound.ndim == 1:
+                confound = np.atleast_2d(confound).T
+            elif confound.ndim != 2:
+                raise ValueError("confound array has an incorrect number "
+                                 "of dimensions: %d" % confound.ndim)
+        else:
+            raise TypeError("confound has an unhandled type: %s"
+                            % confound.__class__)
+        all_confounds.append(confound)
+
+    if len(set(confound.shape[0] for confound in all_confounds)) > 1:
+        raise ValueError("Confound signal has an incorrect length")
+    return np.hstack(all_confounds)
+
+
+class CleaningPlan(object):
+    """Precomputed cleaning of signals, for repeated calls to clean.
+
+    When many signals are cleaned with the same parameters, a plan computes
+    the filter coefficients, reads the confounds and computes the basis of
+    the nuisance signals only once, instead of once per call to clean.
+
+    Parameters
+    ==========
+    detrend, standardize, confounds, low_pass, high_pass, t_r, dtype:
+        see nilearn.signal.clean. Confounds given here are removed from all
+        signals cleaned by the plan: they fix the length of these signals.
+
+    See also
+    ========
+    nilearn.signal.clean
+    """
+
+    def __init__(self, detrend=True, standardize=True, confounds=None,
+                 low_pass=None, high_pass=None, t_r=2.5, dtype=None):
+        self.detrend = detrend
+        self.standardize = standardize
+        self.low_pass = low_pass
+        self.high_pass = high_pass
+        self.t_r = t_r
+        self.dtype = dtype
+        self.confounds = _load_confounds(confounds)
+
+        self._filter = None
+        if low_pass is not None or high_pass is not None:
+            self._filter = _butterworth_coefficients(
+                1. / t_r, low_pass=low_pass, high_pass=high_pass)
+        # Nuisance basis, for each signal length
+        self._nuisances = {}
+
+    def __getstate__(self):
+        # The nuisance bases are cheap to recompute: they are neither sent
+        # to other processes nor hashed for caching.
+        state = self.__dict__.copy()
+        state['_nuisances'] = {}
+        return state
+
+    def _confounds_basis(self, confounds):
+        """Orthonormal basis of confounds, orthogonal to the trends if
+        detrending."""
+        confounds = _ensure_float(confounds)
+        if self.dtype is not None:
+            confounds = np.asarray(confounds, dtype=self.dtype)
+        # Confounds are detrended or centered: their basis is
+        # orthogonal to the trends.
+        confounds = _standardize(confounds, normalize=True,
+                                 detrend=self.detrend)
+        # Rank threshold, relative to the working precision
+        tol = np.finfo(confounds.dtype).eps * 100.
+
+        if (LooseVersion(scipy.__version__) > LooseVersion('0.9.0')):
+            # Pivoting in qr decomposition was added in scipy 0.10
+            Q, R, _ = linalg.qr(confounds, mode='economic', pivoting=True)
+            return Q[:, np.abs(np.diag(R)) > tol]
+        Q, R = linalg.qr(confounds, mode='economic')
+        non_null_diag = np.abs(np.diag(R)) > tol
+        if not np.all(non_null_diag):
+            Q = linalg.qr(confounds[:, non_null_diag], mode='economic')[0]
+        return Q
+
+    def _nuisance_basis(self, n_samples, segments, confounds=None):
+        """Orthonormal basis of trends and confounds, or None.
+
+        The basis is block-diagonal: each segment (session) of the signals
+        has its own trends and confounds columns.
+        """
+        if self.confounds is not None and confounds is not None:
+            all_confounds = np.hstack((self.confounds, confounds))
+        elif confounds is not None:
+            all_confounds = confounds
+        else:
+            all_confounds = self.confounds
+        if all_confounds is not None and all_confounds.shape[0] != n_samples:
+            raise ValueError("Confound signal has an incorrect length")
+
+        # Detrending and confounds removal are done at once, by a
+        # projection on the orthogonal of the nuisance signals.
+        nuisances = []
+        for segment in segments:
+            segment_samples = np.arange(n_samples)[segment]
+            if self.detrend:
+                if len(segment_samples) == 1:
+                    warnings.warn('Detrending of 3D signal has been requested '
+                                  'but would lead to zero values. Skipping.')
+                else:
+                    nuisances.append(
+                        (segment, _trends(len(segment_samples))))
+            if all_confounds is not None:
+                nuisances.append(
+                    (segment, self._confounds_basis(all_confounds[segment])))
+
+        if len(nuisances) == 0:
+            return None
+        Q = np.zeros((n_samples, sum(q.shape[1] for _, q in nuisances)),
+                     dtype=np.float if self.dtype is None else self.dtype)
+        column = 0
+        for segment, q in nuisances:
+            # Blocks of different segments have disjoint supports: the
+            # columns stay orthonormal.
+            Q[segment, column:column + q.shape[1]] = q
+            column += q.shape[1]
+        return Q
+
+    def transform(self, signals, confounds=None, sessions=None):
+        """Clean signals.
+
+        Parameters
+        ==========
+        signals: numpy.ndarray
+            Timeseries. Must have shape (instant number, features number).
+            This array is not modified.
+
+        confounds: numpy.ndarray, str or list of
+            Additional confounds, specific to these signals. See
+            nilearn.signal.clean.
+
+        sessions: numpy array, optional
+            Session of each sample. Each session is cleaned independently,
+            in a single pass over the signals. See nilearn.signal.clean.
+
+        Returns
+        =======
+        cleaned_signals: numpy.ndarray
+            Input signals, cleaned. Same shape as `signals`.
+        """
+        confounds = _load_confounds(confounds)
+
+        signals = _ensure_float(signals)
+        if self.dtype is not None:
+            signals = np.asarray(signals, dtype=self.dtype)
+        # A single copy of signals is made, and cleaned in place.
+        signals = signals.copy()
+        n_samples = signals.shape[0]
+
+        if sessions is None:
+            segments = [slice(None)]
+        else:
+            segments = _session_segments(sessions, n_samples)
+
+        if confounds is None and sessions is None:
+            if n_samples not in self._nuisances:
+                self._nuisances[n_samples] = self._nuisance_basis(
+                    n_samples, segments)
+            Q = self._nuisances[n_samples]
+        else:
+            Q = self._nuisance_basis(n_samples, segments,
+                                     confounds=confounds)
+
+        standardize = self.standardize
+        if standardize and min(len(np.arange(n_samples)[segment])
+                               for segment in segments) == 1:
+            warnings.warn('Standardization of 3D signal has been requested '
+                          'but would lead to zero values. Skipping.')
+            standardize = False
+
+        # All steps work on each signal independently: they are chained on
+        # blocks of signals, in a single pass over the data.
+        for batch in _column_batches(n_samples, signals.shape[1],
+                                     signals.dtype.itemsize):
+            block = signals[:, batch]
+            if Q is not None:
+                block -= np.dot(Q, np.dot(Q.T, block))
+            if self._filter is None and not standardize:
+                continue
+            for segment in segments:
+                # A view for contiguous sessions, a copy otherwise
+                segment_block = block[segment]
+                if self._filter is not None:
+                    b, a = self._filter
+                    for timeseries in segment_block.T:
+                        timeseries[:] = signal.filtfilt(b, a, timeseries)
+                if standardize:
+                    segment_block -= segment_block.mean(axis=0)
+                    std = np.sqrt((segment_block ** 2).sum(axis=0))
+                    # avoid numerical problems
+                    std[std < np.finfo(np.float).eps] = 1.
+                    segment_block /= std
+                    # for unit variance
+                    segment_block *= np.sqrt(segment_block.shape[0])
+                if not isinstance(segment, slice):
+                    block[segment] = segment_block
+        return signals
+
+
+class OnlineCleaner(object):
+    """Clean signals online, as their samples arrive.
+
+    Detrending, confounds removal and standardization are computed from
+    all the samples seen so far, which are not stored: the cleaner keeps
+    running sums, updated in O(n_features) time for each new sample. Once
+    all samples are seen, cleaning them gives the same result as
+    nilearn.signal.clean.
+
+    Parameters
+    ==========
+    detrend: bool, optional
+        If True, linear trends are removed.
+
+    standardize: bool, optional
+        If True, cleaned signals are set to unit variance.
+
+    Attributes
+    ==========
+    n_samples_seen_: int
+        Number of samples given to partial_fit.
+
+    Notes
+    =====
+    Trends and confounds are removed by a least-squares regression on the
+    regressors (constant, linear trend, confounds). The triangular factor
+    of the QR decomposition of the regressors, and the projection of the
+    signals on its orthonormal factor, are updated with each new sample.
+    The residual sum of squares is updated at the same time: with the
+    constant as only regressor, this is the update of Welford's algorithm
+    for the variance.
+
+    The constant is always part of the regressors when confounds are
+    given: cleaned signals are centered. Confounds should be linearly
+    independent. Temporal filtering is not available.
+
+    See also
+    ========
+    nilearn.signal.clean
+    """
+
+    def __init__(self, detrend=True, standardize=True):
+        self.detrend = detrend
+        self.standardize = standardize
+
+    def _regressors(self, times, confounds):
+        regressors = []
+        if self.detrend or self.standardize or confounds is not None:
+            regressors.append(np.ones((len(times), 1)))
+        if self.detrend:
+            regressors.append(np.asarray(times, dtype=np.float)[:, None])
+        if confounds is not None:
+            if confounds.shape[0] != len(times):
+                raise ValueError("Confound signal has an incorrect length")
+            regressors.append(confounds)
+        if len(regressors) == 0:
+            return np.empty((len(times), 0))
+        regressors = np.hstack(regressors)
+        if (hasattr(self, '_r') and
+                regressors.shape[1] != self._r.shape[1]):
+            raise ValueError("The number of confounds must be the same for "
+                             "all samples: %i regressors, expected %i"
+                             % (regressors.shape[1], self._r.shape[1]))
+        return regressors
+
+    def partial_fit(self, signals, confounds=None):
+        """Update the cleaning with new samples.
+
+        Parameters
+        ==========
+        signals: numpy.ndarray
+            New samples of the timeseries. Shape: (new instant number,
+            features number), or (features number,) for a single sample.
+
+        confounds: numpy.ndarray, str or list of
+            Confounds of the new samples. See nilearn.signal.clean. The same
+            confounds must be given for all samples.
+
+        Returns
+        =======
+        self: OnlineCleaner
+        """
+        signals = np.atleast_2d(_ensure_float(signals))
+        confounds = _load_confounds(confounds)
+        n_seen = getattr(self, 'n_samples_seen_', 0)
+        regressors = self._regressors(
+            np.arange(n_seen, n_seen + signals.shape[0]), confounds)
+
+        if n_seen == 0:
+            n_regressors = regressors.shape[1]
+            self._r = np.zeros((n_regressors, n_regressors))
+            self._z = np.zeros((n_regressors, signals.shape[1]))
+            self._rss = np.zeros(signals.shape[1])
+
+        if regressors.shape[1] == 0:
+            # Nothing to remove: signals are only counted
+            self.n_samples_seen_ = n_seen + signals.shape[0]
+            return self
+
+        for x, y in izip(regressors, signals):
+            # Update of the QR decomposition with the new row (x, y) of the
+            # regression problem: after rotation, the part of y that is not
+            # explained by the regressors is in the last row.
+            q, self._r = linalg.qr(np.vstack((self._r, x)))
+            q = q.T
+            z = np.dot(q[:, :-1], self._z)
+            z += q[:, -1:] * y
+            self._z = z[:-1]
+            self._rss += z[-1] ** 2
+            # Only the square part of the triangular factor is kept
+            self._r = self._r[:-1]
+        self.n_samples_seen_ = n_seen + signals.shape[0]
+        return self
+
+    def transform(self, signals, confounds=None):
+        """Clean the last samples given to partial_fit.
+
+        Parameters
+        ==========
+        signals: numpy.ndarray
+            Last samples of the timeseries given to partial_fit. Shape:
+            (instant number, features number).
+
+        confounds: numpy.ndarray, str or list of
+            Confounds of these samples.
+
+        Returns
+        =======
+        cleaned_signals: numpy.ndarray
+            Signals, cleaned with the regression coefficients and the
+            variance of all the samples seen so far.
+        """
+        if not hasattr(self, 'n_samples_seen_'):
+            raise ValueError('This OnlineCleaner has not been fitted. '
+                             'You must call partial_fit() before calling '
+                             'transform().')
+        signals = np.array(np.atleast_2d(_ensure_float(signals)),
+                           dtype=np.float)
+        confounds = _load_confounds(confounds)
+        n_samples = signals.shape[0]
+        if n_samples > self.n_samples_seen_:
+            raise ValueError("Only samples given to partial_fit can be "
+                             "transformed: %i samples, %i seen"
+                             % (n_samples, self.n_samples_seen_))
+        regressors = self._regressors(
+            np.arange(self.n_samples_seen_ - n_samples,
+                      self.n_samples_seen_), confounds)
+
+        if regressors.shape[1] > 0:
+            # The triangular factor is singular with less samples than
+            # regressors: least squares give the coefficients.
+            coefs = linalg.lstsq(self._r, self._z)[0]
+            signals -= np.dot(regressors, coefs)
+        if self.standardize:
+            if self.n_samples_seen_ == 1:
+                warnings.warn('Standardization of 3D signal has been '
+                              'requested but would lead to zero values. '
+                              'Skipping.')
+                return signals
+            std = np.sqrt(self._rss / self.n_samples_seen_)
+            # avoid numerical problems
+            std[std < np.finfo(np.float).eps] = 1.
+            signals /= std
+        return signals
+
+
 def clean(signals, sessions=None, detrend=True, standardize=True,
-          confounds=None, low_pass=None, high_pass=None, t_r=2.5):
+          confounds=None, low_pass=None, high_pass=None, t_r=2.5,
+          dtype=None, sample_mask=None):
     """Improve SNR on masked fMRI signals.
 
        This function can do several things on the input signals, in
@@ -368,9 +1078,11 @@ def clean(signals, sessions=None, detrend=True, standardize=True,
            Timeseries. Must have shape (instant number, features number).
            This array is not modified.
 
-    sessions : numpy array, optional
-        Add a session level to the cleaning process. Each session will be
-        cleaned independently. Must be a 1D array of n_samples elements.
+       sessions : numpy array, optional
+           Add a session level to the cleaning process. Each session will be
+           cleaned independently, with its own trends and confounds, in a
+           single pass over the signals. Must be a 1D array of n_samples
+           elements.
 
        confounds: numpy.ndarray, str or list of
            Confounds timeseries. Shape must be
@@ -395,11 +1107,36 @@ def clean(signals, sessions=None, detrend=True, standardize=True,
        standardize: bool
            If True, returned signals are set to unit variance.
 
+       dtype: numpy dtype, optional
+           Floating point type used for the computations and for the output.
+           np.float32 halves memory usage and speeds up confounds removal,
+           at the cost of precision: results differ from double precision
+           ones by a relative error of the order of 1e-6, more if the
+           confounds are badly conditioned. Butterworth filtering is always
+           computed in double precision, one signal at a time.
+           If None, float signals keep their type, other signals are
+           converted to float.
+
+       sample_mask: Any type compatible with numpy-array indexing, optional
+           Samples to keep, e.g. to censor (scrub) volumes with motion.
+           signals, confounds and sessions are given for all samples, and
+           only the kept samples are returned. Without filtering, the
+           result is that of cleaning signals[sample_mask]. With filtering,
+           kept samples must be in increasing order: censored samples are
+           first replaced by a linear interpolation of their kept neighbors,
+           so that filtering sees evenly-sampled signals, and removed after
+           filtering.
+
        Returns
        =======
        cleaned_signals: numpy.ndarray
            Input signals, cleaned. Same shape as `signals`.
 
+       See also
+       ========
+       nilearn.signal.CleaningPlan: to clean many signals with the same
+       parameters.
+
        Notes
        =====
        Confounds removal is based on a projection on the orthogonal
@@ -410,94 +1147,143 @@ def clean(signals, sessions=None, detrend=True, standardize=True,
        <http://dx.doi.org/10.1002/hbm.460020402>`_
     """
 
-    if not isinstance(confounds,
-                      (list, tuple, _basestring, np.ndarray, type(None))):
-        raise TypeError("confounds keyword has an unhandled type: %s"
-                        % confounds.__class__)
-    
-    # Read confounds
-    if confounds is not None:
-        if not isinstance(confounds, (list, tuple)):
-            confounds = (confounds, )
-
-        all_confounds = []
-        for confound in confounds:
-            if isinstance(confound, _basestring):
-                filename = confound
-                confound = csv_to_array(filename)
-                if np.isnan(confound.flat[0]):
-                    # There may be a header
-                    if NP_VERSION >= [1, 4, 0]:
-                        confound = csv_to_array(filename, skip_header=1)
-                    else:
-                        confound = csv_to_array(filename, skiprows=1)
-                if confound.shape[0] != signals.shape[0]:
-                    raise ValueError("Confound signal has an incorrect length")
-
-            elif isinstance(confound, np.ndarray):
-                if confound.ndim == 1:
-                    confound = np.atleast_2d(confound).T
-                elif confound.ndim != 2:
-                    raise ValueError("confound array has an incorrect number "
-                                     "of dimensions: %d" % confound.ndim)
-
-                if confound.shape[0] != signals.shape[0]:
-                    raise ValueError("Confound signal has an incorrect length")
-            else:
-                raise TypeError("confound has an unhandled type: %s"
-                                % confound.__class__)
-            all_confounds.append(confound)
-
-        # Restrict the signal to the orthogonal of the confounds
-        confounds = np.hstack(all_confounds)
-        del all_confounds
-
-    if sessions is not None:
-        if not len(sessions) == len(signals):
-            raise ValueError(('The length of the session vector (%i) '
-                              'does not match the length of the signals (%i)')
-                              % (len(sessions), len(signals)))
-        for s in np.unique(sessions):
-            session_confounds = None
-            if confounds is not None:
-                session_confounds = confounds[sessions == s]
-            signals[sessions == s, :] = \
-                clean(signals[sessions == s],
-                      detrend=detrend, standardize=standardize,
-                      confounds=session_confounds, low_pass=low_pass,
-                      high_pass=high_pass, t_r=2.5)
-
-    # detrend
-    signals = _ensure_float(signals)
-    signals = _standardize(signals, normalize=False, detrend=detrend)
-
-    # Remove confounds
-    if confounds is not None:
-        confounds = _ensure_float(confounds)
-        confounds = _standardize(confounds, normalize=True, detrend=detrend)
+    confounds = _load_confounds(confounds)
+    if confounds is not None and confounds.shape[0] != signals.shape[0]:
+        raise ValueError("Confound signal has an incorrect length")
+
+    if sample_mask is not None:
+        kept = np.arange(signals.shape[0])[sample_mask]
+        if kept.size == 0:
+            raise ValueError("sample_mask must keep at least one sample.")
+        if sessions is not None:
+            kept_sessions = np.asarray(sessions)[kept]
+        if low_pass is None and high_pass is None:
+            # Censored samples are simply dropped
+            return clean(signals[kept], sessions=(None if sessions is None
+                                                  else kept_sessions),
+                         detrend=detrend, standardize=standardize,
+                         confounds=(None if confounds is None
+                                    else confounds[kept]),
+                         t_r=t_r, dtype=dtype)
+
+        if np.any(np.diff(kept) <= 0):
+            raise ValueError("When filtering, sample_mask must select "
+                             "samples in increasing order.")
+        signals = _interpolate_censored(signals, kept)
+        if confounds is not None:
+            confounds = _interpolate_censored(confounds, kept)
+        plan = CleaningPlan(detrend=detrend, standardize=False,
+                            confounds=confounds, low_pass=low_pass,
+                            high_pass=high_pass, t_r=t_r, dtype=dtype)
+        signals = plan.transform(signals, sessions=sessions)[kept]
+        if not standardize:
+            return signals
+        # Standardization on the kept samples only
+        return CleaningPlan(detrend=False, standardize=True).transform(
+            signals, sessions=None if sessions is None else kept_sessions)
+
+    plan = CleaningPlan(detrend=detrend, standardize=standardize,
+                        confounds=confounds, low_pass=low_pass,
+                        high_pass=high_pass, t_r=t_r, dtype=dtype)
+    return plan.transform(signals, sessions=sessions)
+
+
+def _batched_dot(a, b):
+    """Matrix products of stacks of matrices: a[i].dot(b[i]) for all i."""
+    if hasattr(np, 'matmul'):
+        # Added in numpy 1.10, uses BLAS
+        return np.matmul(a, b)
+    return np.einsum('ijk,ikl->ijl', a, b)
+
+
+def clean_batch(signals_list, confounds_list=None, detrend=True,
+                standardize=True, low_pass=None, high_pass=None, t_r=2.5,
+                dtype=None):
+    """Clean the signals of several subjects sharing the same design.
+
+    This is the same as calling nilearn.signal.clean on the signals of each
+    subject, but all subjects are cleaned at once: trends and confounds are
+    removed with batched matrix products, and filtering is applied to all
+    subjects together.
 
-        if (LooseVersion(scipy.__version__) > LooseVersion('0.9.0')):
-            # Pivoting in qr decomposition was added in scipy 0.10
-            Q, R, _ = linalg.qr(confounds, mode='economic', pivoting=True)
-            Q = Q[:, np.abs(np.diag(R)) > np.finfo(np.float).eps * 100.]
-            signals -= Q.dot(Q.T).dot(signals)
-        else:
-            Q, R = linalg.qr(confounds, mode='economic')
-            non_null_diag = np.abs(np.diag(R)) > np.finfo(np.float).eps * 100.
-            if np.all(non_null_diag):
-                signals -= Q.dot(Q.T).dot(signals)
-            elif np.any(non_null_diag):
-                R = R[:, non_null_diag]
-                confounds = confounds[:, non_null_diag]
-                inv = scipy.linalg.inv(np.dot(R.T, R))
-                signals -= confounds.dot(inv).dot(confounds.T).dot(signals)
-
-    if low_pass is not None or high_pass is not None:
-        signals = butterworth(signals, sampling_rate=1. / t_r,
-                              low_pass=low_pass, high_pass=high_pass)
-
-    if standardize:
-        signals = _standardize(signals, normalize=True, detrend=False)
-        signals *= np.sqrt(signals.shape[0])  # for unit variance
+    Parameters
+    ==========
+    signals_list: list of numpy.ndarray
+        Timeseries of each subject. All must have the same shape
+        (instant number, features number). These arrays are not modified.
 
-    return signals
+    confounds_list: list of confounds, optional
+        Confounds of each subject, or None. Each item is given as the
+        confounds parameter of nilearn.signal.clean. Must be of same length
+        as signals_list.
+
+    detrend, standardize, low_pass, high_pass, t_r, dtype:
+        see nilearn.signal.clean.
+
+    Returns
+    =======
+    cleaned_signals: list of numpy.ndarray
+        Signals of each subject, cleaned.
+
+    See also
+    ========
+    nilearn.signal.clean
+    """
+    if len(signals_list) == 0:
+        return []
+    if len(set(signals.shape for signals in signals_list)) > 1:
+        raise ValueError("All signals must have the same shape, got %s"
+                         % sorted(set(signals.shape
+                                      for signals in signals_list)))
+    if confounds_list is None:
+        confounds_list = [None] * len(signals_list)
+    elif len(confounds_list) != len(signals_list):
+        raise ValueError("confounds_list must have the same length as "
+                         "signals_list: %i != %i"
+                         % (len(confounds_list), len(signals_list)))
+
+    # A single copy of all signals, cleaned in place
+    signals = np.array([_ensure_float(s) for s in signals_list],
+                       dtype=dtype)
+    n_subjects, n_samples, n_features = signals.shape
+
+    plan = CleaningPlan(detrend=detrend, standardize=standardize,
+                        low_pass=low_pass, high_pass=high_pass, t_r=t_r,
+                        dtype=signals.dtype)
+    bases = [plan._nuisance_basis(n_samples, [slice(None)],
+                                  confounds=_load_confounds(confounds))
+             for confounds in confounds_list]
+    Q = None
+    if any(basis is not None for basis in bases):
+        # Null columns complete the bases of subjects with less confounds,
+        # or none
+        Q = np.zeros((n_subjects, n_samples,
+                      max(basis.shape[1] for basis in bases
+                          if basis is not None)),
+                     dtype=signals.dtype)
+        for subject_Q, basis in izip(Q, bases):
+            if basis is not None:
+                subject_Q[:, :basis.shape[1]] = basis
+        Q_T = Q.transpose((0, 2, 1)).copy()
+
+    if standardize and n_samples == 1:
+        warnings.warn('Standardization of 3D signal has been requested '
+                      'but would lead to zero values. Skipping.')
+        standardize = False
+
+    for batch in _column_batches(n_subjects * n_samples, n_features,
+                                 signals.dtype.itemsize):
+        block = signals[:, :, batch]
+        if Q is not None:
+            block -= _batched_dot(Q, _batched_dot(Q_T, block))
+        if plan._filter is not None:
+            b, a = plan._filter
+            block[...] = signal.filtfilt(b, a, block, axis=1)
+        if standardize:
+            block -= block.mean(axis=1)[:, np.newaxis]
+            std = np.sqrt((block ** 2).sum(axis=1))
+            # avoid numerical problems
+            std[std < np.finfo(np.float).eps] = 1.
+            block /= std[:, np.newaxis]
+            block *= np.sqrt(n_samples)  # for unit variance
+    return list(signals)
@@ -162,6 +162,57 @@ def test_apply_mask():
                   Nifti1Image(data, affine), mask_img)
 
 
+def test_apply_mask_chunked():
+    rng = np.random.RandomState(42)
+    data = rng.randn(9, 10, 11, 7)
+    data[2, 3, 4, 5] = np.nan
+    mask = np.zeros((9, 10, 11), dtype=np.int8)
+    mask[2:-2, 3:-3, 1:-1] = 1
+    affine = np.diag((2, 2, 3, 1))
+    data_img = Nifti1Image(data, affine)
+    mask_img = Nifti1Image(mask, affine)
+
+    for create_files in (False, True):
+        with write_tmp_imgs(data_img, create_files=create_files) as filename:
+            for smoothing_fwhm in (None, 4):
+                series = masking.apply_mask(filename, mask_img,
+                                            smoothing_fwhm=smoothing_fwhm)
+                for chunk_size in (1, 3, 7, 20):
+                    chunked = masking.apply_mask(
+                        filename, mask_img, smoothing_fwhm=smoothing_fwhm,
+                        chunk_size=chunk_size)
+                    assert_equal(chunked.shape, (7, mask.sum()))
+                    np.testing.assert_array_almost_equal(chunked, series)
+
+    assert_raises(ValueError, masking.apply_mask, data_img, mask_img,
+                  chunk_size=0)
+
+
+def test_apply_mask_smoothing_box():
+    # Smoothing only the bounding box of the mask must give the same result
+    # as smoothing the whole image
+    from nilearn.image.image import _smooth_array
+
+    rng = np.random.RandomState(0)
+    data = rng.randn(20, 21, 22, 4)
+    data[8, 9, 10, 2] = np.nan
+    affine = np.diag((2, 3, 2.5, 1))
+    mask = np.zeros((20, 21, 22), dtype=np.int8)
+    mask[7:11, 5:9, 12:17] = 1
+    mask[9, 8, 18] = 1
+    data_img = Nifti1Image(data, affine)
+    mask_img = Nifti1Image(mask, affine)
+
+    for smoothing_fwhm in (3, [6, 2, 4], 'fast'):
+        expected = _smooth_array(data, affine, fwhm=smoothing_fwhm,
+                                 copy=True)[mask.astype(bool)].T
+        for chunk_size in (None, 3):
+            series = masking.apply_mask(data_img, mask_img,
+                                        smoothing_fwhm=smoothing_fwhm,
+                                        chunk_size=chunk_size)
+            np.testing.assert_array_equal(series, expected)
+
+
 def test_unmask():
     # A delta in 3D
     shape = (10, 20, 30, 40)
@@ -3,11 +3,11 @@
 This test file is in nilearn/tests because nosetests ignores modules whose
 name starts with an underscore
 """
-from nose.tools import assert_raises
+from nose.tools import assert_raises, assert_equal
 
 import numpy as np
 
-from nilearn._utils.ndimage import largest_connected_component
+from nilearn._utils.ndimage import largest_connected_component, _thread_map
 
 
 def test_largest_cc():
@@ -20,3 +20,10 @@ def test_largest_cc():
     b = a.copy()
     b[5, 5, 5] = 1
     np.testing.assert_equal(a, largest_connected_component(b))
+
+
+def test_thread_map():
+    for n_jobs in (1, 2, -1):
+        assert_equal(_thread_map(lambda x: x ** 2, range(5), n_jobs=n_jobs),
+                     [0, 1, 4, 9, 16])
+    assert_raises(ValueError, _thread_map, abs, range(5), n_jobs=0)
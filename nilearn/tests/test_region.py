@@ -5,6 +5,7 @@ Test for "region" module.
 # License: simplified BSD
 
 import numpy as np
+from scipy import linalg
 from nose.tools import assert_raises, assert_true
 
 import nibabel
@@ -204,6 +205,33 @@ def test_signals_extraction_with_labels():
                   good_labels_img, mask_img=bad_mask2_img)
 
 
+def test_signals_extraction_with_labels_against_ndimage():
+    # Compare with a per-scan region mean, with regions that are missing
+    # because of the mask, and non-consecutive labels.
+    from scipy import ndimage
+    shape = (9, 10, 11)
+    n_instants = 7
+    rng = np.random.RandomState(42)
+    labels_data = rng.randint(0, 6, size=shape) * 3
+    labels_img = nibabel.Nifti1Image(labels_data, np.eye(4))
+    mask_data = labels_data != 9
+    mask_img = nibabel.Nifti1Image(mask_data.astype(np.int8), np.eye(4))
+    data = rng.randn(*(shape + (n_instants, )))
+    data_img = nibabel.Nifti1Image(data, np.eye(4))
+
+    signals, labels = region.img_to_signals_labels(data_img, labels_img,
+                                                   mask_img=mask_img)
+    assert_true(labels == [3, 6, 9, 12, 15])
+    masked_labels_data = labels_data.copy()
+    masked_labels_data[np.logical_not(mask_data)] = 0
+    for n in range(n_instants):
+        expected = ndimage.measurements.mean(data[..., n],
+                                             labels=masked_labels_data,
+                                             index=[3, 6, 12, 15])
+        np.testing.assert_almost_equal(signals[n, [0, 1, 3, 4]], expected)
+    np.testing.assert_array_equal(signals[:, 2], 0)
+
+
 def test_signal_extraction_with_maps():
     shape = (10, 11, 12)
     n_regions = 9
@@ -272,6 +300,39 @@ def test_signal_extraction_with_maps():
                   good_maps_img, mask_img=bad_mask2_img)
 
 
+def test_sparse_maps_against_lstsq():
+    # Sparse maps must give the same result as a dense least-squares fit,
+    # including with overlapping maps and linearly dependent maps.
+    shape = (8, 9, 10)
+    n_instants = 7
+    rand_gen = np.random.RandomState(0)
+
+    maps_data = rand_gen.randn(*(shape + (5,)))
+    maps_data[rand_gen.rand(*maps_data.shape) < .8] = 0
+    data = rand_gen.randn(*(shape + (n_instants,)))
+    img = nibabel.Nifti1Image(data, np.eye(4))
+
+    for maps in (maps_data,
+                 # duplicated and empty maps
+                 np.concatenate((maps_data, maps_data[..., :1],
+                                 np.zeros(shape + (1,))), axis=-1)):
+        maps_img = nibabel.Nifti1Image(maps, np.eye(4))
+        sparse_maps = region._SparseMaps(maps_img)
+        assert_true(sparse_maps.maps.nnz == np.sum(maps != 0))
+
+        flat_maps = maps.reshape(-1, maps.shape[-1])
+        expected = linalg.lstsq(flat_maps,
+                                data.reshape(-1, n_instants))[0].T
+        np.testing.assert_almost_equal(sparse_maps.img_to_signals(img),
+                                       expected)
+
+        signals = rand_gen.randn(n_instants, maps.shape[-1])
+        img_r = sparse_maps.signals_to_img(signals)
+        np.testing.assert_almost_equal(
+            img_r.get_data(),
+            np.dot(flat_maps, signals.T).reshape(shape + (n_instants,)))
+
+
 def test_signal_extraction_with_maps_and_labels():
     shape = (4, 5, 6)
     n_regions = 7
@@ -5,10 +5,14 @@ Test the signals module
 # License: simplified BSD
 
 import os.path
+import shutil
+import tempfile
 
 import numpy as np
 from nose.tools import assert_true, assert_false, assert_raises
+from nose import SkipTest
 
+import nilearn
 # Use nisignal here to avoid name collisions (using nilearn.signal is
 # not possible)
 from nilearn import signal as nisignal
@@ -148,6 +152,35 @@ def test_butterworth():
     np.testing.assert_almost_equal(out1, out2)
 
 
+def test_butterworth_methods():
+    rand_gen = np.random.RandomState(0)
+    data = rand_gen.randn(1000, 100)
+    kwargs = dict(sampling_rate=.5, low_pass=.1, high_pass=.01)
+
+    out = nisignal.butterworth(data, method='fft', copy=True, **kwargs)
+    # single timeseries are filtered in place
+    timeseries = data[:, 0].copy()
+    nisignal.butterworth(timeseries, method='fft', **kwargs)
+    np.testing.assert_almost_equal(timeseries, out[:, 0])
+
+    assert_raises(ValueError, nisignal.butterworth, data, method='foo',
+                  **kwargs)
+
+    if not hasattr(scipy.signal, 'sosfiltfilt'):
+        raise SkipTest('scipy.signal.sosfiltfilt requires scipy >= 0.18')
+    sos = nisignal._butterworth_coefficients(0.5, low_pass=.1, high_pass=.01,
+                                             output='sos')
+    expected = scipy.signal.sosfiltfilt(sos, data, axis=0)
+    out_sos = data.copy()
+    nisignal.butterworth(out_sos, method='sos', **kwargs)
+    np.testing.assert_almost_equal(out_sos, expected)
+
+    # The FFT filter considers the signals periodic: the transients of the
+    # filter change the edges, but not the interior of the signals
+    np.testing.assert_almost_equal(out[300:-300], expected[300:-300],
+                                   decimal=3)
+
+
 def test_standardize():
     rand_gen = np.random.RandomState(0)
     n_features = 10
@@ -254,6 +287,122 @@ def test_clean_detrending():
     assert_false(abs(x_undetrended - signals).max() < 0.06)
 
 
+def test_clean_sample_mask():
+    signals, _, confounds = generate_signals(n_features=11, n_confounds=3,
+                                             length=60)
+    signals = signals + generate_trends(n_features=11, length=60)
+    sample_mask = np.ones(60, dtype=bool)
+    sample_mask[[0, 10, 11, 30, 59]] = False
+    # Without filtering, censored samples are dropped
+    np.testing.assert_almost_equal(
+        clean(signals, confounds=confounds, sample_mask=sample_mask),
+        clean(signals[sample_mask], confounds=confounds[sample_mask]))
+
+    # With filtering, censored samples are interpolated: their values do
+    # not matter
+    kwargs = dict(confounds=confounds, low_pass=.1, t_r=2.,
+                  sample_mask=sample_mask)
+    cleaned = clean(signals, **kwargs)
+    assert_true(cleaned.shape == (55, 11))
+    np.testing.assert_almost_equal(cleaned.std(axis=0), np.ones(11))
+    spiky_signals = signals.copy()
+    spiky_signals[~sample_mask] = 1e6
+    np.testing.assert_almost_equal(clean(spiky_signals, **kwargs), cleaned)
+    assert_raises(ValueError, clean, signals, low_pass=.1,
+                  sample_mask=[2, 1, 3])
+    # No sample kept
+    for empty_mask in (np.zeros(60, dtype=bool), []):
+        for low_pass in (None, .1):
+            assert_raises(ValueError, clean, signals, low_pass=low_pass,
+                          t_r=2., sample_mask=empty_mask)
+
+
+def test_clean_batch():
+    rand_gen = np.random.RandomState(0)
+    signals_list = [generate_signals(n_features=17, length=41)[0] +
+                    generate_trends(n_features=17, length=41)
+                    for _ in range(4)]
+    # Subjects have different numbers of confounds
+    confounds_list = [rand_gen.randn(41, n) for n in (1, 2, 3)] + [None]
+    kwargs = dict(detrend=True, standardize=True, low_pass=.1,
+                  high_pass=.01, t_r=2.)
+    cleaned = nisignal.clean_batch(signals_list, confounds_list, **kwargs)
+    assert_true(len(cleaned) == 4)
+    for signals, confounds, out in zip(signals_list, confounds_list,
+                                       cleaned):
+        np.testing.assert_almost_equal(
+            out, clean(signals, confounds=confounds, **kwargs))
+    assert_raises(ValueError, nisignal.clean_batch,
+                  [signals_list[0], signals_list[1][:40]])
+    assert_raises(ValueError, nisignal.clean_batch, signals_list,
+                  confounds_list[:2])
+
+
+def test_clean_batch_missing_confounds():
+    # Without detrending, only some subjects have a nuisance basis
+    rand_gen = np.random.RandomState(0)
+    signals_list = [rand_gen.randn(41, 17) for _ in range(4)]
+    for confounds_list in ([None, rand_gen.randn(41, 2), None,
+                            rand_gen.randn(41, 1)],
+                           [rand_gen.randn(41, 3), None, None, None]):
+        cleaned = nisignal.clean_batch(signals_list, confounds_list,
+                                       detrend=False)
+        for signals, confounds, out in zip(signals_list, confounds_list,
+                                           cleaned):
+            np.testing.assert_almost_equal(
+                out, clean(signals, confounds=confounds, detrend=False))
+
+
+def test_memory_budget():
+    signals, _, confounds = generate_signals(n_features=113, n_confounds=3,
+                                             length=41)
+    signals = signals + generate_trends(n_features=113, length=41)
+    kwargs = dict(confounds=confounds, low_pass=.1, t_r=2.)
+    expected = (clean(signals, **kwargs), nisignal._mean_of_squares(signals),
+                nisignal._standardize(signals, detrend=True))
+    max_temporary_bytes = nilearn.MAX_TEMPORARY_BYTES
+    try:
+        # Blocks of 3 columns
+        nilearn.MAX_TEMPORARY_BYTES = 3 * 41 * 8
+        assert_true(len(list(nisignal._column_batches(41, 113))) == 38)
+        np.testing.assert_almost_equal(clean(signals, **kwargs), expected[0])
+        np.testing.assert_almost_equal(nisignal._mean_of_squares(signals),
+                                       expected[1])
+        np.testing.assert_almost_equal(
+            nisignal._standardize(signals, detrend=True), expected[2])
+    finally:
+        nilearn.MAX_TEMPORARY_BYTES = max_temporary_bytes
+
+
+def test_read_confounds_file():
+    confounds = np.random.RandomState(0).randn(20, 3)
+    tempdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tempdir, 'confounds.csv')
+        with open(filename, 'w') as csv_file:
+            csv_file.write('a,b,c\n')
+            for row in confounds:
+                csv_file.write(','.join(repr(value) for value in row) + '\n')
+        out = nisignal._read_confounds_file(filename)
+        np.testing.assert_almost_equal(out, confounds)
+        # The parsed file is reused, and protected against modifications
+        assert_true(nisignal._read_confounds_file(filename) is out)
+        assert_false(out.flags.writeable)
+
+        nilearn.CONFOUNDS_NPY_SIDECAR = True
+        nisignal._confounds_files.clear()
+        out = nisignal._read_confounds_file(filename)
+        assert_true(os.path.exists(filename + '.npy'))
+        np.testing.assert_array_equal(np.load(filename + '.npy'), out)
+        np.testing.assert_almost_equal(
+            clean(confounds, confounds=filename, standardize=False),
+            np.zeros(confounds.shape))
+    finally:
+        nilearn.CONFOUNDS_NPY_SIDECAR = False
+        nisignal._confounds_files.clear()
+        shutil.rmtree(tempdir)
+
+
 def test_clean_frequencies():
     sx1 = np.sin(np.linspace(0, 100, 2000))
     sx2 = np.sin(np.linspace(0, 100, 2000))
@@ -351,6 +500,89 @@ def test_clean_confounds():
                   confounds=[None])
 
 
+def test_clean_single_projection():
+    # Cleaning must give the same result as the successive steps, each
+    # done on the whole signals
+    signals, noises, confounds = generate_signals(n_features=600,
+                                                  n_confounds=4, length=50)
+    signals = signals + noises + generate_trends(n_features=600, length=50)
+
+    detrended = nisignal._detrend(signals)
+    confounds_ = nisignal._standardize(confounds, normalize=True,
+                                       detrend=True)
+    Q = np.linalg.qr(confounds_)[0]
+    expected = detrended - np.dot(Q, np.dot(Q.T, detrended))
+    expected = nisignal.butterworth(expected, sampling_rate=.5,
+                                    low_pass=.1, high_pass=.01, copy=True)
+    expected = nisignal._standardize(expected, normalize=True)
+    expected *= np.sqrt(expected.shape[0])
+
+    cleaned = clean(signals, detrend=True, standardize=True,
+                    confounds=confounds, low_pass=.1, high_pass=.01, t_r=2.)
+    np.testing.assert_almost_equal(cleaned, expected)
+
+
+def test_clean_dtype():
+    # Single precision cleaning must be close to double precision one
+    signals, noises, confounds = generate_signals(n_features=41,
+                                                  n_confounds=5, length=45)
+    trends = generate_trends(n_features=41, length=45)
+    signals = signals + noises + trends
+    # A linearly dependent confound
+    confounds = np.hstack((confounds, confounds[:, :1] + confounds[:, 1:2]))
+
+    kwargs = dict(detrend=True, standardize=True, confounds=confounds,
+                  low_pass=.1, high_pass=.01, t_r=2.)
+    cleaned64 = clean(signals, **kwargs)
+    cleaned32 = clean(signals, dtype=np.float32, **kwargs)
+    assert_true(cleaned64.dtype == np.float64)
+    assert_true(cleaned32.dtype == np.float32)
+    np.testing.assert_allclose(cleaned32, cleaned64, rtol=1e-3, atol=1e-4)
+
+    # float32 signals stay in single precision
+    cleaned = clean(signals.astype(np.float32), **kwargs)
+    assert_true(cleaned.dtype == np.float32)
+
+
+def test_cleaning_plan():
+    signals, _, confounds = generate_signals(n_features=41, n_confounds=3,
+                                             length=45)
+    other_confounds = np.random.RandomState(0).randn(45, 2)
+    kwargs = dict(detrend=True, standardize=True, low_pass=.1,
+                  high_pass=.01, t_r=2.)
+    plan = nisignal.CleaningPlan(confounds=confounds, **kwargs)
+    np.testing.assert_almost_equal(plan.transform(signals),
+                                   clean(signals, confounds=confounds,
+                                         **kwargs))
+    # The nuisance basis is computed once, and reused
+    assert_true(45 in plan._nuisances)
+    np.testing.assert_almost_equal(plan.transform(2 * signals),
+                                   plan.transform(signals))
+    # Confounds given at transform time are added to those of the plan
+    np.testing.assert_almost_equal(
+        plan.transform(signals, confounds=other_confounds),
+        clean(signals, confounds=[confounds, other_confounds], **kwargs))
+    assert_raises(ValueError, plan.transform, signals[:40])
+
+
+def test_clean_sessions():
+    signals, _, confounds = generate_signals(n_features=11, n_confounds=3,
+                                             length=120)
+    signals = signals + generate_trends(n_features=11, length=120)
+    kwargs = dict(detrend=True, standardize=True, low_pass=.1, t_r=2.)
+    # Interleaved sessions: each session is cleaned independently
+    sessions = np.tile([0, 1, 2], 40)
+    cleaned = clean(signals, sessions=sessions, confounds=confounds,
+                    **kwargs)
+    for session in range(3):
+        session_mask = sessions == session
+        np.testing.assert_almost_equal(
+            cleaned[session_mask],
+            clean(signals[session_mask],
+                  confounds=confounds[session_mask], **kwargs))
+    assert_raises(ValueError, clean, signals, sessions=sessions[:-1])
+
+
 def test_high_variance_confounds():
     # C and F order might take different paths in the function. Check that the
     # result is identical.
@@ -409,3 +641,44 @@ def test_high_variance_confounds():
     np.testing.assert_almost_equal(
         np.min(np.abs(np.dstack([outG - outGt, outG + outGt])), axis=2),
         np.zeros(outG.shape))
+
+
+def test_high_variance_confounds_randomized():
+    rand_gen = np.random.RandomState(0)
+    n_samples, n_features, n_confounds = 60, 2000, 3
+    # Low rank series, with a little noise
+    series = np.dot(rand_gen.randn(n_samples, n_confounds),
+                    rand_gen.randn(n_confounds, n_features) * 10.)
+    series += .01 * rand_gen.randn(n_samples, n_features)
+    out = nisignal.high_variance_confounds(series, n_confounds=n_confounds,
+                                           percentile=5.)
+    out_randomized = nisignal.high_variance_confounds(
+        series, n_confounds=n_confounds, percentile=5.,
+        svd_solver='randomized', random_state=0)
+    assert_true(out_randomized.shape == out.shape)
+    # Both span the same space
+    np.testing.assert_almost_equal(
+        np.linalg.svd(out.T.dot(out_randomized))[1], np.ones(n_confounds))
+    assert_raises(ValueError, nisignal.high_variance_confounds, series,
+                  svd_solver='foo')
+
+
+def test_online_cleaner():
+    signals, _, confounds = generate_signals(n_features=17, n_confounds=3,
+                                             length=41)
+    signals = signals + generate_trends(n_features=17, length=41) + 100.
+    for detrend, standardize in ((True, True), (True, False),
+                                 (False, True)):
+        cleaner = nisignal.OnlineCleaner(detrend=detrend,
+                                         standardize=standardize)
+        # Samples arrive one at a time
+        for sample, sample_confounds in zip(signals, confounds):
+            cleaner.partial_fit(sample, confounds=sample_confounds[None])
+        assert_true(cleaner.n_samples_seen_ == 41)
+        np.testing.assert_almost_equal(
+            cleaner.transform(signals, confounds=confounds),
+            clean(signals, detrend=detrend, standardize=standardize,
+                  confounds=confounds))
+    # The number of confounds cannot change
+    assert_raises(ValueError, cleaner.partial_fit, signals[:1])
+    assert_raises(ValueError, nisignal.OnlineCleaner().transform, signals)